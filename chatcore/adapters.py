@@ -0,0 +1,282 @@
+"""Per-source payload adapters.
+
+An adapter turns a provider's inbound webhook payload into the normalized dict
+IncomingWebhookView stores, and shapes the outbound payload posted to the
+provider. ``Source.adapter`` names a registered adapter:
+
+- ``generic``: the flat schema documented by WebhookSerializer, validated
+  without going through DRF.
+- ``mapping``: declarative field paths from ``Source.field_mapping``::
+
+      {
+          "inbound": {"external_user_id": "sender.id", "content": "message.text",
+                      "attachments": "message.files"},
+          "outbound": {"recipient.id": "external_user_id", "message.text": "content"}
+      }
+
+  Inbound maps a normalized field to a dotted path in the provider payload
+  (list indexes are numbers); outbound maps a dotted path in the provider
+  payload to a field of the default outbound payload. Mappings are compiled
+  once into extractor functions and cached.
+
+Register more adapters with ``@register('name')``.
+"""
+import json
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import ProhibitNullCharactersValidator
+from rest_framework.exceptions import ValidationError as DRFValidationError
+from rest_framework.fields import ProhibitSurrogateCharactersValidator
+
+FIELDS = ('external_message_id', 'external_user_id', 'timestamp', 'content', 'thread_id')
+REQUIRED_FIELDS = ('external_user_id',)
+# fields WebhookSerializer accepts as blank
+BLANK_FIELDS = ('external_message_id', 'content', 'thread_id')
+# fields an inbound mapping may set
+INBOUND_FIELDS = FIELDS + ('attachments',)
+
+# the validators DRF's CharField runs on every value
+CHAR_VALIDATORS = (ProhibitNullCharactersValidator(), ProhibitSurrogateCharactersValidator())
+
+# returned by mapping paths that don't exist in the payload (an explicit null is None)
+MISSING = object()
+
+_registry = {}
+
+
+class AdapterError(Exception):
+    """Invalid inbound payload; ``errors`` mirrors DRF's serializer.errors."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def register(name):
+    def decorator(cls):
+        cls.name = name
+        _registry[name] = cls
+        return cls
+    return decorator
+
+
+def registered_adapters():
+    return sorted(_registry)
+
+
+def normalize_payload(data: dict) -> dict:
+    # Minimal normalization: assume input has fields we defined in serializer
+    return {
+        'external_message_id': data.get('external_message_id'),
+        'external_user_id': data.get('external_user_id'),
+        'timestamp': data.get('timestamp'),
+        'content': data.get('content'),
+        'thread_id': data.get('thread_id'),
+        'raw': data,
+    }
+
+
+def _run_char_validators(value):
+    messages = []
+    for validator in CHAR_VALIDATORS:
+        try:
+            validator(value)
+        except DjangoValidationError as exc:
+            messages.extend(exc.messages)
+        except DRFValidationError as exc:
+            messages.extend(str(detail) for detail in exc.detail)
+    return messages
+
+
+def validate_fields(values):
+    """Validate extracted values the way WebhookSerializer's CharFields do.
+
+    A key that is absent counts as not provided; a key present with ``None``
+    is an explicit null, which none of the fields allow.
+    """
+    errors = {}
+    validated = {}
+    for field in FIELDS:
+        if field not in values:
+            if field in REQUIRED_FIELDS:
+                errors[field] = ['This field is required.']
+            continue
+        value = values[field]
+        if value is None:
+            errors[field] = ['This field may not be null.']
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            errors[field] = ['Not a valid string.']
+            continue
+        value = str(value).strip()
+        if not value:
+            if field not in BLANK_FIELDS:
+                errors[field] = ['This field may not be blank.']
+                continue
+            validated[field] = value
+            continue
+        messages = _run_char_validators(value)
+        if messages:
+            errors[field] = messages
+            continue
+        validated[field] = value
+    if errors:
+        raise AdapterError(errors)
+    return validated
+
+
+class BaseAdapter(ABC):
+    name = None
+
+    def __init__(self, source):
+        self.source = source
+
+    @abstractmethod
+    def message_id(self, data):
+        """The provider's message id, read without validating the payload."""
+
+    @abstractmethod
+    def normalize(self, data):
+        """Return the normalized dict for ``data``; raise AdapterError if invalid."""
+
+    def outbound_payload(self, msg):
+        return {
+            'conversation_id': str(msg.conversation_id),
+            'external_user_id': msg.conversation.external_contact.external_id if msg.conversation.external_contact else None,
+            'content': msg.content,
+            'message_id': str(msg.id),
+        }
+
+
+@register('generic')
+class GenericAdapter(BaseAdapter):
+    def message_id(self, data):
+        return data.get('external_message_id') if isinstance(data, Mapping) else None
+
+    def normalize(self, data):
+        if not isinstance(data, Mapping):
+            raise AdapterError({'non_field_errors': [f'Invalid data. Expected a dictionary, but got {type(data).__name__}.']})
+        errors = {}
+        try:
+            validated = validate_fields(data)
+        except AdapterError as exc:
+            errors = exc.errors
+        raw = data.get('raw', MISSING)
+        if raw is None:
+            errors['raw'] = ['This field may not be null.']
+        elif raw is not MISSING and not isinstance(raw, Mapping):
+            errors['raw'] = [f'Expected a dictionary of items but got type "{type(raw).__name__}".']
+        if errors:
+            raise AdapterError(errors)
+        if raw is not MISSING:
+            validated['raw'] = dict(raw)
+        return normalize_payload(validated)
+
+
+def _steps(path):
+    return tuple(int(step) if step.isdigit() else step for step in path.split('.'))
+
+
+@lru_cache(maxsize=1024)
+def _getter(path):
+    steps = _steps(path)
+    if len(steps) == 1:
+        key = steps[0]
+        return lambda data: data.get(key, MISSING) if isinstance(data, Mapping) else MISSING
+
+    def get(data):
+        for step in steps:
+            try:
+                data = data[step]
+            except (KeyError, IndexError, TypeError):
+                return MISSING
+        return data
+    return get
+
+
+@lru_cache(maxsize=256)
+def compile_inbound(mapping_json):
+    """Compile ``{field: path}`` into a function returning ``{field: value}``.
+
+    Fields whose path is missing from the payload are left out.
+    """
+    mapping = json.loads(mapping_json)
+    getters = tuple((field, _getter(path)) for field, path in mapping.items())
+
+    def extract(data):
+        values = {}
+        for field, get in getters:
+            value = get(data)
+            if value is not MISSING:
+                values[field] = value
+        return values
+    return extract
+
+
+@lru_cache(maxsize=256)
+def compile_outbound(mapping_json):
+    """Compile ``{target_path: field}`` into a function shaping the outbound payload.
+
+    Raises ValueError when a target path repeats or is a prefix of another one
+    (``message`` and ``message.text`` can't both be set).
+    """
+    mapping = json.loads(mapping_json)
+    # sorted, a path is directly followed by any path it is a prefix of
+    targets = sorted(((_steps(path), path) for path in mapping), key=lambda t: [(isinstance(s, int), str(s)) for s in t[0]])
+    for (steps, path), (next_steps, next_path) in zip(targets, targets[1:]):
+        if next_steps[:len(steps)] == steps:
+            raise ValueError(f'outbound paths "{path}" and "{next_path}" conflict')
+    setters = tuple((_steps(path)[:-1], _steps(path)[-1], field) for path, field in mapping.items())
+
+    def shape(payload):
+        out = {}
+        for parents, leaf, field in setters:
+            node = out
+            for step in parents:
+                node = node.setdefault(step, {})
+            node[leaf] = payload.get(field)
+        return out
+    return shape
+
+
+@register('mapping')
+class MappingAdapter(BaseAdapter):
+    def __init__(self, source):
+        super().__init__(source)
+        mapping = source.field_mapping or {}
+        inbound = {field: field for field in FIELDS}
+        inbound.update(mapping.get('inbound', {}))
+        self._extract = compile_inbound(json.dumps(inbound, sort_keys=True))
+        self._get_message_id = _getter(inbound['external_message_id'])
+        outbound = mapping.get('outbound')
+        self._shape = compile_outbound(json.dumps(outbound, sort_keys=True)) if outbound else None
+
+    def message_id(self, data):
+        value = self._get_message_id(data)
+        return None if value is MISSING else value
+
+    def normalize(self, data):
+        if not isinstance(data, Mapping):
+            raise AdapterError({'non_field_errors': [f'Invalid data. Expected a dictionary, but got {type(data).__name__}.']})
+        values = self._extract(data)
+        normalized = normalize_payload(validate_fields(values))
+        # keep the provider payload; attachments come from the mapping if given
+        normalized['raw'] = dict(data)
+        if values.get('attachments') is not None:
+            normalized['raw']['attachments'] = values['attachments']
+        return normalized
+
+    def outbound_payload(self, msg):
+        payload = super().outbound_payload(msg)
+        return self._shape(payload) if self._shape else payload
+
+
+def get_adapter(source):
+    try:
+        adapter_class = _registry[source.adapter or 'generic']
+    except KeyError:
+        raise LookupError(f'unknown payload adapter {source.adapter!r} for source {source.slug}')
+    return adapter_class(source)
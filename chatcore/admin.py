@@ -1,19 +1,24 @@
+import json
+
 from django.contrib import admin
 from django.urls import path
 from django.shortcuts import redirect
 from django.utils.html import format_html
 
-from .models import Source, ExternalContact, Conversation, Message, DeliveryReceipt, WebhookEvent
+from .models import Source, ExternalContact, Conversation, Message, DeliveryReceipt, WebhookEvent, SourceHourlyStats, RequestProfile
+from . import assignment
+from .paginators import LargeTablePaginator
 
 
 @admin.register(Source)
 class SourceAdmin(admin.ModelAdmin):
-    list_display = ('slug', 'display_name', 'is_active')
+    list_display = ('slug', 'display_name', 'is_active', 'adapter', 'batch_outbound', 'assignment_policy')
     search_fields = ('slug', 'display_name')
 
 @admin.register(ExternalContact)
 class ExternalContactAdmin(admin.ModelAdmin):
     list_display = ('external_id', 'display_name', 'source')
+    list_select_related = ('source',)
 
 
 class MessageInline(admin.TabularInline):
@@ -21,14 +26,37 @@ class MessageInline(admin.TabularInline):
     extra = 0
     readonly_fields = ('direction', 'sender_name', 'content', 'status', 'created_at')
     fields = ('direction', 'sender_name', 'content', 'status', 'created_at')
+    # only the latest messages are rendered; the full history is in the Message admin
+    max_recent = 50
+    verbose_name_plural = 'Messages (most recent 50)'
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        object_id = request.resolver_match.kwargs.get('object_id') if request.resolver_match else None
+        if not object_id:
+            return qs.none()
+        recent = list(
+            qs.filter(conversation_id=object_id).order_by('-created_at').values_list('pk', flat=True)[:self.max_recent]
+        )
+        return qs.filter(pk__in=recent).order_by('created_at')
 
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
     list_display = ('id', 'source', 'external_contact', 'is_closed', 'updated_at')
+    list_select_related = ('source', 'external_contact__source')
     inlines = [MessageInline]
     search_fields = ('id__exact', 'title', 'external_contact__display_name', 'external_contact__external_id')
-    
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at',)
+    paginator = LargeTablePaginator
+    show_full_result_count = False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'is_closed' in form.changed_data:
+            assignment.adjust_load(obj, -1 if obj.is_closed else 1)
+
     def get_urls(self):
         urls = super().get_urls()
         my_urls = [
@@ -49,11 +77,69 @@ class ConversationAdmin(admin.ModelAdmin):
 @admin.register(DeliveryReceipt)
 class DeliveryReceiptAdmin(admin.ModelAdmin):
     list_display = ('message', 'status', 'timestamp')
+    list_select_related = ('message',)
+    paginator = LargeTablePaginator
+    show_full_result_count = False
 
 
 @admin.register(WebhookEvent)
 class WebhookEventAdmin(admin.ModelAdmin):
     list_display = ('id', 'source', 'processed', 'created_at')
+    list_select_related = ('source',)
+    paginator = LargeTablePaginator
+    show_full_result_count = False
+    exclude = ('raw_payload', 'headers', 'raw_body', 'header_set', 'volatile_headers')
+    readonly_fields = ('body_codec', 'payload_preview', 'headers_preview')
+
+    def get_queryset(self, request):
+        # bodies are only decompressed when a single event is opened
+        return super().get_queryset(request).defer('raw_payload', 'headers', 'raw_body')
+
+    def payload_preview(self, obj):
+        payload = obj.payload
+        if payload is None:
+            return format_html('<pre>{}</pre>', obj.body.decode('utf-8', errors='replace'))
+        return format_html('<pre>{}</pre>', json.dumps(payload, indent=2))
+    payload_preview.short_description = "Payload"
+
+    def headers_preview(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.request_headers, indent=2))
+    headers_preview.short_description = "Headers"
+
+@admin.register(SourceHourlyStats)
+class SourceHourlyStatsAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'source', 'inbound_count', 'outbound_count', 'sent_count', 'failed_count', 'first_response_count', 'backlog')
+    list_filter = ('source',)
+    list_select_related = ('source',)
+    date_hierarchy = 'bucket'
+    ordering = ('-bucket',)
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'kind', 'method', 'name', 'status', 'duration_ms', 'query_count', 'query_time_ms', 'duplicate_count')
+    list_filter = ('kind',)
+    search_fields = ('name', 'username')
+    ordering = ('-created_at',)
+    readonly_fields = (
+        'kind', 'name', 'method', 'status', 'username', 'duration_ms', 'query_count', 'query_time_ms',
+        'duplicates_preview', 'profile_preview', 'created_at',
+    )
+    exclude = ('duplicate_queries', 'profile')
+
+    def has_add_permission(self, request):
+        return False
+
+    def duplicate_count(self, obj):
+        return len(obj.duplicate_queries)
+    duplicate_count.short_description = "Repeated queries"
+
+    def duplicates_preview(self, obj):
+        return format_html('<pre>{}</pre>', '\n\n'.join(f"{d['count']}x {d['sql']}" for d in obj.duplicate_queries))
+    duplicates_preview.short_description = "Repeated queries"
+
+    def profile_preview(self, obj):
+        return format_html('<pre>{}</pre>', obj.profile)
+    profile_preview.short_description = "Profile"
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
@@ -81,6 +167,11 @@ class MessageAdmin(admin.ModelAdmin):
     )
     readonly_fields = ("created_at", "updated_at")
     autocomplete_fields = ("conversation", "sender_internal_user", "source")
+    list_select_related = ("conversation", "source")
+    date_hierarchy = "created_at"
+    ordering = ("-created_at",)
+    paginator = LargeTablePaginator
+    show_full_result_count = False
 
     def short_content(self, obj):
         return (obj.content[:60] + "...") if obj.content and len(obj.content) > 60 else obj.content
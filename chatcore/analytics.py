@@ -0,0 +1,172 @@
+"""Hourly per-source rollups for the ops dashboards.
+
+``update_rollups`` only reads rows created since the last watermark, so each
+periodic run costs the same regardless of table size. ``rebuild_range``
+recomputes a historical range from scratch.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateTimeField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+
+from .models import Conversation, DeliveryReceipt, Message, RollupWatermark, Source, SourceHourlyStats
+
+WATERMARK_NAME = 'source_hourly_stats'
+COUNTER_FIELDS = (
+    'inbound_count',
+    'outbound_count',
+    'sent_count',
+    'failed_count',
+    'first_response_count',
+    'first_response_seconds',
+)
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _first_responses(messages):
+    """Outbound messages that answered a waiting inbound, with the wait start.
+
+    The wait starts at the first inbound message after the previous outbound
+    one; a reply with no inbound message since the last reply is not counted.
+    """
+    previous_out = Message.objects.filter(
+        conversation=OuterRef('conversation'),
+        direction=Message.DIRECTION_OUT,
+        created_at__lt=OuterRef('created_at'),
+    ).order_by('-created_at').values('created_at')[:1]
+    first_in = Message.objects.filter(
+        conversation=OuterRef('conversation'),
+        direction=Message.DIRECTION_IN,
+        created_at__lt=OuterRef('created_at'),
+        created_at__gt=Coalesce(OuterRef('previous_out'), Value(EPOCH), output_field=DateTimeField()),
+    ).order_by('created_at').values('created_at')[:1]
+    return (
+        messages.filter(direction=Message.DIRECTION_OUT)
+        .annotate(previous_out=Subquery(previous_out))
+        .annotate(waiting_since=Subquery(first_in))
+        .filter(waiting_since__isnull=False)
+        .values_list('source_id', 'created_at', 'waiting_since')
+    )
+
+
+def compute_window(since, until):
+    """Return ``{(source_id, bucket): {counter: value}}`` for rows in [since, until)."""
+    counters = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+
+    messages = Message.objects.filter(created_at__gte=since, created_at__lt=until)
+    volume = (
+        messages.annotate(bucket=TruncHour('created_at'))
+        .values('source_id', 'bucket', 'direction')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    for row in volume:
+        field = 'inbound_count' if row['direction'] == Message.DIRECTION_IN else 'outbound_count'
+        counters[(row['source_id'], row['bucket'])][field] += row['n']
+
+    receipts = (
+        DeliveryReceipt.objects.filter(timestamp__gte=since, timestamp__lt=until, status__in=('SENT', 'FAILED'))
+        .annotate(bucket=TruncHour('timestamp'))
+        .values('message__source_id', 'bucket', 'status')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    for row in receipts:
+        field = 'sent_count' if row['status'] == 'SENT' else 'failed_count'
+        counters[(row['message__source_id'], row['bucket'])][field] += row['n']
+
+    for source_id, created_at, waiting_since in _first_responses(messages).iterator():
+        bucket = counters[(source_id, floor_hour(created_at))]
+        bucket['first_response_count'] += 1
+        bucket['first_response_seconds'] += (created_at - waiting_since).total_seconds()
+
+    return counters
+
+
+def apply_counters(counters):
+    """Add computed counters onto the stored buckets."""
+    for (source_id, bucket), values in counters.items():
+        increments = {field: F(field) + value for field, value in values.items() if value}
+        if not increments:
+            continue
+        if SourceHourlyStats.objects.filter(source_id=source_id, bucket=bucket).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                SourceHourlyStats.objects.create(source_id=source_id, bucket=bucket, **values)
+        except IntegrityError:
+            # created concurrently (e.g. by the backlog snapshot)
+            SourceHourlyStats.objects.filter(source_id=source_id, bucket=bucket).update(**increments)
+
+
+def backlog_by_source():
+    """Open conversations whose latest message is inbound, per source."""
+    last_direction = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at').values('direction')[:1]
+    rows = (
+        Conversation.objects.filter(is_closed=False)
+        .annotate(last_direction=Subquery(last_direction))
+        .filter(last_direction=Message.DIRECTION_IN)
+        .values('source_id')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    return {row['source_id']: row['n'] for row in rows}
+
+
+def snapshot_backlog(now=None):
+    bucket = floor_hour(now or timezone.now())
+    backlog = backlog_by_source()
+    for source_id in Source.objects.filter(is_active=True).values_list('pk', flat=True):
+        SourceHourlyStats.objects.update_or_create(source_id=source_id, bucket=bucket, defaults={'backlog': backlog.get(source_id, 0)})
+
+
+def _settled_until(now=None):
+    # rows younger than the lag are left for the next run so that transactions
+    # still in flight when the job runs are not skipped
+    now = now or timezone.now()
+    return now - timedelta(seconds=getattr(settings, 'ANALYTICS_ROLLUP_LAG_SECONDS', 60))
+
+
+def _locked_watermark(default_position):
+    RollupWatermark.objects.get_or_create(name=WATERMARK_NAME, defaults={'position': default_position})
+    return RollupWatermark.objects.select_for_update().get(name=WATERMARK_NAME)
+
+
+def update_rollups(now=None):
+    """Fold rows created since the watermark into the hourly buckets."""
+    now = now or timezone.now()
+    until = _settled_until(now)
+    with transaction.atomic():
+        # history before the first run is filled in with the rebuild_analytics command
+        watermark = _locked_watermark(until)
+        if watermark.position < until:
+            apply_counters(compute_window(watermark.position, until))
+            watermark.position = until
+            watermark.save(update_fields=['position'])
+    snapshot_backlog(now)
+
+
+def rebuild_range(since, until):
+    """Recompute the counters of every bucket overlapping [since, until).
+
+    Rows past the watermark are left to update_rollups so nothing is counted
+    twice. Returns the (hour-aligned) range that was reset.
+    """
+    since = floor_hour(since)
+    if floor_hour(until) != until:
+        until = floor_hour(until) + timedelta(hours=1)
+    with transaction.atomic():
+        watermark = _locked_watermark(min(until, _settled_until()))
+        SourceHourlyStats.objects.filter(bucket__gte=since, bucket__lt=until).update(**dict.fromkeys(COUNTER_FIELDS, 0))
+        end = min(until, watermark.position)
+        if since < end:
+            apply_counters(compute_window(since, end))
+    return since, until
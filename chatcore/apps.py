@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ChatcoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatcore'
+
+    def ready(self):
+        from . import profiling, signals  # noqa: F401
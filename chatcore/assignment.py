@@ -0,0 +1,166 @@
+"""Automatic assignment of new conversations to agents.
+
+Agents are active staff users (restricted to the CHAT_AGENT_GROUP group when
+that setting is set). With a Redis-backed cache (DJANGO_CACHE_URL) the number
+of open conversations per agent lives in a Redis sorted set, so choosing the
+least-loaded agent is a single atomic script call shared by every process.
+Without Redis the load is counted from the database instead.
+
+The Redis counters can drift (conversations closed outside the admin, agents
+added or removed); the periodic ``resync_agent_loads`` task rebuilds them from
+the database.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+LOAD_KEY = 'chatcore:agent-load'
+AGENT_IDS_KEY = 'chatcore:agent-ids'
+AGENT_IDS_TIMEOUT = 60
+
+# pick the member with the lowest score and count the new conversation against it
+PICK_LEAST_LOADED = """
+local picked = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+if picked then
+    redis.call('ZINCRBY', KEYS[1], 1, picked)
+end
+return picked
+"""
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    url = getattr(settings, 'CACHE_URL', None)
+    if not url:
+        return None
+    import redis
+    return redis.Redis.from_url(url)
+
+
+def agent_queryset():
+    qs = get_user_model().objects.filter(is_active=True, is_staff=True)
+    group = getattr(settings, 'CHAT_AGENT_GROUP', None)
+    if group:
+        qs = qs.filter(groups__name=group)
+    return qs
+
+
+def agent_ids():
+    ids = cache.get(AGENT_IDS_KEY)
+    if ids is None:
+        ids = list(agent_queryset().order_by('pk').values_list('pk', flat=True))
+        cache.set(AGENT_IDS_KEY, ids, AGENT_IDS_TIMEOUT)
+    return ids
+
+
+def open_loads():
+    """Open conversations per agent, counted from the database."""
+    rows = agent_queryset().annotate(load=Count('conversations', filter=Q(conversations__is_closed=False)))
+    return dict(rows.values_list('pk', 'load'))
+
+
+def resync_loads():
+    """Rebuild the Redis load counters from the database."""
+    cache.delete(AGENT_IDS_KEY)
+    client = get_redis()
+    if client is None:
+        return
+    loads = open_loads()
+    pipe = client.pipeline()
+    pipe.delete(LOAD_KEY)
+    if loads:
+        pipe.zadd(LOAD_KEY, {str(pk): load for pk, load in loads.items()})
+    pipe.execute()
+
+
+def _ensure_loads(client):
+    """Seed the load set from the database if it is missing (fresh Redis, flush).
+
+    Agents added since the last resync join with no load. Returns
+    ``{member: agent id}`` for the current agents.
+    """
+    current = {str(pk): pk for pk in agent_ids()}
+    if not client.exists(LOAD_KEY):
+        resync_loads()
+    elif current:
+        client.zadd(LOAD_KEY, dict.fromkeys(current, 0), nx=True)
+    return current
+
+
+def _add_load(client, agent_id, delta):
+    # XX: never create the set (or a member) from a single increment
+    client.zadd(LOAD_KEY, {str(agent_id): delta}, xx=True, incr=True)
+
+
+def _least_loaded():
+    client = get_redis()
+    if client is None:
+        loads = open_loads()
+        return min(loads, key=lambda pk: (loads[pk], pk)) if loads else None
+
+    current = _ensure_loads(client)
+    if not current:
+        return None
+    script = client.register_script(PICK_LEAST_LOADED)
+    for _ in range(len(current) + 1):
+        picked = script(keys=[LOAD_KEY])
+        if picked is None:
+            return None
+        picked = picked.decode()
+        if picked in current:
+            return current[picked]
+        # no longer an agent; drop it until the next resync
+        client.zrem(LOAD_KEY, picked)
+    return None
+
+
+def _round_robin(source):
+    key = f'chatcore:assign-rr:{source.pk}'
+    client = get_redis()
+    if client is not None:
+        # keep the least-loaded counters right for sources using either policy
+        _ensure_loads(client)
+    ids = agent_ids()
+    if not ids:
+        return None
+    if client is not None:
+        turn = client.incr(key)
+    else:
+        cache.add(key, 0, timeout=None)
+        turn = cache.incr(key)
+    agent_id = ids[(turn - 1) % len(ids)]
+    if client is not None:
+        _add_load(client, agent_id, 1)
+    return agent_id
+
+
+def assign_conversation(conversation):
+    """Add an agent to ``conversation`` according to its source's policy.
+
+    Returns the assigned user id, or None when the source does not assign or
+    no agent is available.
+    """
+    policy = conversation.source.assignment_policy
+    if policy == conversation.source.ASSIGN_LEAST_LOADED:
+        agent_id = _least_loaded()
+    elif policy == conversation.source.ASSIGN_ROUND_ROBIN:
+        agent_id = _round_robin(conversation.source)
+    else:
+        return None
+    if agent_id is not None:
+        conversation.participants.add(agent_id)
+    return agent_id
+
+
+def adjust_load(conversation, delta):
+    """Add ``delta`` to the load of every participant, e.g. -1 when it is closed."""
+    client = get_redis()
+    if client is None:
+        return
+    pipe = client.pipeline()
+    for pk in conversation.participants.values_list('pk', flat=True):
+        _add_load(pipe, pk, delta)
+    pipe.execute()
@@ -0,0 +1,117 @@
+"""Token authentication backed by a short-lived local + shared cache.
+
+A token is resolved from a per-process dict first (TOKEN_AUTH_LOCAL_TTL
+seconds), then from the Django cache (Redis in deployments,
+TOKEN_AUTH_CACHE_TTL seconds), and only then from the database. Deleting a
+token or saving its user (e.g. deactivating it) drops the shared entry and this
+process's local entry immediately (see chatcore.signals); other processes stop
+using their local copy within TOKEN_AUTH_LOCAL_TTL seconds.
+
+Cached users are loaded without their password hash. Invalidation leaves a
+short-lived tombstone instead of deleting the shared entry, so a lookup that
+read the database just before the change can't cache its stale result again.
+
+FrontendKeyAuthentication runs ahead of it and accepts the FRONTEND_API_KEY
+``X-API-KEY`` header without any cache or database lookup.
+"""
+import copy
+import hashlib
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication
+
+LOCAL_MAX_ENTRIES = 1024
+# left in the shared cache by invalidate_token(); must outlive a token lookup
+TOMBSTONE = 'invalidated'
+TOMBSTONE_TTL = 30
+# request.auth of requests authenticated by FrontendKeyAuthentication
+FRONTEND_KEY = 'frontend-key'
+
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _cache_key(key):
+    # never use the raw token as a cache key name
+    return 'chatcore:auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def _local_get(key):
+    entry = _local.get(key)
+    if entry is None:
+        return None
+    expires, value = entry
+    if expires < time.monotonic():
+        _local.pop(key, None)
+        return None
+    return value
+
+
+def _local_set(key, value):
+    ttl = getattr(settings, 'TOKEN_AUTH_LOCAL_TTL', 5)
+    with _local_lock:
+        if len(_local) >= LOCAL_MAX_ENTRIES:
+            _local.clear()
+        _local[key] = (time.monotonic() + ttl, value)
+
+
+def invalidate_token(key):
+    _local.pop(key, None)
+    cache.set(_cache_key(key), TOMBSTONE, TOMBSTONE_TTL)
+
+
+def clear_local_cache():
+    _local.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def lookup(self, key):
+        """DRF's token + user query, without the password hash."""
+        model = self.get_model()
+        try:
+            token = model.objects.select_related('user').defer('user__password').get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
+
+    def authenticate_credentials(self, key):
+        cached = _local_get(key)
+        if cached is None:
+            shared = cache.get(_cache_key(key))
+            if shared is None or shared == TOMBSTONE:
+                cached = self.lookup(key)
+                # add() fails if the token was invalidated since the get()
+                if shared is None and cache.add(_cache_key(key), cached, getattr(settings, 'TOKEN_AUTH_CACHE_TTL', 300)):
+                    _local_set(key, cached)
+            else:
+                cached = shared
+                _local_set(key, cached)
+        user, token = cached
+        # each request gets its own instance so per-request changes don't leak
+        return copy.copy(user), token
+
+
+class FrontendKeyAuthentication(BaseAuthentication):
+    """Authenticate requests carrying the frontend ``X-API-KEY`` header.
+
+    The request stays anonymous with ``request.auth == FRONTEND_KEY``; views
+    opt in with AdminOrFrontendTokenPermission. Listed first in
+    DEFAULT_AUTHENTICATION_CLASSES so token and session authentication (and
+    their lookups) are skipped for these requests.
+    """
+
+    def authenticate(self, request):
+        key = request.headers.get('X-API-KEY')
+        expected = getattr(settings, 'FRONTEND_API_KEY', None)
+        if key and expected and hmac.compare_digest(key.encode(), expected.encode()):
+            return AnonymousUser(), FRONTEND_KEY
+        return None
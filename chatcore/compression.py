@@ -0,0 +1,39 @@
+"""Compression helpers for raw webhook bodies.
+
+zlib is always available; zstd is used when the optional ``zstandard`` package
+is installed and ``WEBHOOK_BODY_CODEC`` asks for it.
+"""
+import zlib
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+CODEC_ZLIB = 'zlib'
+CODEC_ZSTD = 'zstd'
+
+
+def default_codec() -> str:
+    codec = getattr(settings, 'WEBHOOK_BODY_CODEC', CODEC_ZLIB)
+    if codec == CODEC_ZSTD and zstandard is None:
+        return CODEC_ZLIB
+    return codec
+
+
+def compress(data: bytes, codec: str = None) -> tuple:
+    """Return ``(codec, compressed_bytes)`` for ``data``."""
+    codec = codec or default_codec()
+    if codec == CODEC_ZSTD:
+        return codec, zstandard.ZstdCompressor(level=3).compress(data)
+    return CODEC_ZLIB, zlib.compress(data, 6)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read zstd-compressed webhook bodies')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
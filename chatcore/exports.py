@@ -0,0 +1,119 @@
+"""Streaming transcript exports.
+
+Rows are read with ``QuerySet.iterator()`` (a server-side cursor on Postgres)
+and encoded incrementally, so memory use does not grow with the export size.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Message
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# (queryset field, output column)
+EXPORT_FIELDS = (
+    ('id', 'id'),
+    ('conversation_id', 'conversation_id'),
+    ('source__slug', 'source'),
+    ('direction', 'direction'),
+    ('sender_name', 'sender_name'),
+    ('content', 'content'),
+    ('external_message_id', 'external_message_id'),
+    ('status', 'status'),
+    ('created_at', 'created_at'),
+)
+EXPORT_COLUMNS = [column for _, column in EXPORT_FIELDS]
+
+# rows encoded per yielded chunk
+FLUSH_ROWS = 500
+
+# spreadsheets evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_bound(value):
+    """Parse an ISO date or datetime query value; dates mean midnight UTC."""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'invalid date: {value}')
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def export_queryset(conversation=None, source=None, since=None, until=None):
+    qs = Message.objects.all()
+    if conversation:
+        qs = qs.filter(conversation_id=conversation)
+    if source:
+        qs = qs.filter(source__slug=source)
+    if since:
+        qs = qs.filter(created_at__gte=since)
+    if until:
+        qs = qs.filter(created_at__lt=until)
+    return qs.order_by('created_at', 'id').values_list(*[field for field, _ in EXPORT_FIELDS])
+
+
+def iter_ndjson(qs, chunk_size=2000):
+    lines = []
+    for row in qs.iterator(chunk_size=chunk_size):
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row)), cls=DjangoJSONEncoder))
+        if len(lines) >= FLUSH_ROWS:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def csv_cell(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # content comes from external users; keep it text when opened in a spreadsheet
+        return "'" + value
+    return value
+
+
+def iter_csv(qs, chunk_size=2000):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    rows = 0
+    for row in qs.iterator(chunk_size=chunk_size):
+        writer.writerow([csv_cell(value) for value in row])
+        rows += 1
+        if rows % FLUSH_ROWS == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def render_export(qs, output='ndjson', gzip=False, chunk_size=2000):
+    """Return an iterator of encoded bytes for ``qs`` in the requested format."""
+    stream = iter_csv(qs, chunk_size) if output == 'csv' else iter_ndjson(qs, chunk_size)
+    return gzip_stream(stream) if gzip else stream
@@ -0,0 +1,134 @@
+"""Fast-path detection of duplicate webhook deliveries.
+
+Deliveries are keyed on ``(source, external_message_id)``:
+
+1. an optional in-process bloom filter remembers keys this process has already
+   stored; a hit is confirmed with a cache read (never rejected on the bloom
+   filter alone) and skips the SET NX write,
+2. ``cache.add`` (SET NX on Redis) claims the key with a short TTL while the
+   delivery is processed and is upgraded to WEBHOOK_IDEMPOTENCY_TTL once the
+   message is stored,
+3. the ``unique_external_message_id`` constraint stays the final authority
+   for anything that slips past the cache (eviction, TTL expiry).
+"""
+import hashlib
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+
+NEW = 'new'
+DUPLICATE = 'duplicate'
+IN_PROGRESS = 'in_progress'
+
+_PENDING = 'pending'
+_DONE = 'done'
+# how long a claim survives a worker that died mid-request
+PENDING_TTL = 60
+
+
+class BloomFilter:
+    """A fixed-size bloom filter that resets itself once ``capacity`` keys were added."""
+
+    def __init__(self, size_bits, hashes=7, capacity=None):
+        self.size = size_bits
+        self.hashes = hashes
+        # past roughly size/10 keys the false-positive rate climbs quickly
+        self.capacity = capacity or size_bits // 10
+        self.bits = bytearray((size_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        with self._lock:
+            if self.count >= self.capacity:
+                self.bits = bytearray(len(self.bits))
+                self.count = 0
+            for pos in self._positions(key):
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+@lru_cache(maxsize=1)
+def get_bloom():
+    size = getattr(settings, 'WEBHOOK_IDEMPOTENCY_BLOOM_BITS', 0)
+    return BloomFilter(size) if size else None
+
+
+def _key(source_id, external_message_id):
+    return f'chatcore:webhook-seen:{source_id}:{external_message_id}'
+
+
+def claim(source_id, external_message_id):
+    """Claim a delivery. Returns NEW, DUPLICATE or IN_PROGRESS (being processed elsewhere)."""
+    key = _key(source_id, external_message_id)
+    bloom = get_bloom()
+    if bloom is not None and key in bloom and cache.get(key) == _DONE:
+        return DUPLICATE
+    if cache.add(key, _PENDING, timeout=PENDING_TTL):
+        return NEW
+    state = cache.get(key)
+    if state == _DONE:
+        if bloom is not None:
+            bloom.add(key)
+        return DUPLICATE
+    if state is None and cache.add(key, _PENDING, timeout=PENDING_TTL):
+        # the previous claim expired in between
+        return NEW
+    return IN_PROGRESS
+
+
+def complete(source_id, external_message_id):
+    key = _key(source_id, external_message_id)
+    cache.set(key, _DONE, timeout=getattr(settings, 'WEBHOOK_IDEMPOTENCY_TTL', 86400))
+    bloom = get_bloom()
+    if bloom is not None:
+        bloom.add(key)
+
+
+def release(source_id, external_message_id):
+    """Drop a claim so the provider's retry is processed again."""
+    cache.delete(_key(source_id, external_message_id))
+
+
+def _metric_key(source_slug, name):
+    return f'chatcore:webhook-metrics:{source_slug}:{name}'
+
+
+def record_delivery(source_slug, duplicate):
+    names = ('received', 'duplicates') if duplicate else ('received',)
+    for name in names:
+        key = _metric_key(source_slug, name)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted between add() and incr()
+            cache.add(key, 1, timeout=None)
+
+
+def delivery_metrics(source_slugs):
+    keys = {slug: (_metric_key(slug, 'received'), _metric_key(slug, 'duplicates')) for slug in source_slugs}
+    values = cache.get_many([k for pair in keys.values() for k in pair])
+    metrics = []
+    for slug, (received_key, duplicates_key) in keys.items():
+        received = values.get(received_key, 0)
+        duplicates = values.get(duplicates_key, 0)
+        metrics.append({
+            'source': slug,
+            'received': received,
+            'duplicates': duplicates,
+            'duplicate_rate': (duplicates / received) if received else None,
+        })
+    return metrics
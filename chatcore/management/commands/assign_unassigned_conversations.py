@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from chatcore.assignment import assign_conversation
+from chatcore.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Assign open conversations that have no participants according to their source policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Conversations read per query')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        pending = (
+            Conversation.objects.select_related('source')
+            .filter(is_closed=False, participants__isnull=True)
+            .order_by('pk')
+        )
+        last_pk = None
+        assigned = skipped = 0
+        while True:
+            qs = pending if last_pk is None else pending.filter(pk__gt=last_pk)
+            chunk = list(qs[:chunk_size])
+            if not chunk:
+                break
+            for conv in chunk:
+                if assign_conversation(conv) is None:
+                    skipped += 1
+                else:
+                    assigned += 1
+            last_pk = chunk[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'Assigned {assigned} conversations ({skipped} left unassigned)'))
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatcore.adapters import AdapterError, get_adapter, normalize_payload
+from chatcore.models import Source
+from chatcore.serializers import WebhookSerializer
+
+FLAT_EVENT = {
+    'external_message_id': 'msg-123',
+    'external_user_id': 'user-42',
+    'timestamp': '2025-01-01T10:00:00Z',
+    'content': 'Hello, I need help with my order',
+    'thread_id': 'thread-7',
+}
+
+NESTED_EVENT = {
+    'id': 'msg-123',
+    'sender': {'id': 'user-42', 'name': 'Jane'},
+    'sent_at': '2025-01-01T10:00:00Z',
+    'message': {'text': 'Hello, I need help with my order', 'files': [{'url': 'https://example.com/a.png'}]},
+    'conversation': {'id': 'thread-7'},
+}
+
+NESTED_MAPPING = {
+    'inbound': {
+        'external_message_id': 'id',
+        'external_user_id': 'sender.id',
+        'timestamp': 'sent_at',
+        'content': 'message.text',
+        'thread_id': 'conversation.id',
+        'attachments': 'message.files',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure inbound normalization throughput (events/sec) per adapter against the DRF serializer path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=20000, help='Events normalized per case')
+
+    def _run(self, label, events, func, payload):
+        start = time.perf_counter()
+        for _ in range(events):
+            func(payload)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{label:<32} {events / elapsed:>12,.0f} events/sec')
+
+    def handle(self, *args, **options):
+        events = options['events']
+
+        def serializer_path(data):
+            serializer = WebhookSerializer(data=data)
+            if not serializer.is_valid():
+                raise AdapterError(serializer.errors)
+            return normalize_payload(serializer.validated_data)
+
+        # unsaved sources: adapters never touch the database
+        generic = get_adapter(Source(slug='bench-generic', adapter='generic'))
+        mapping = get_adapter(Source(slug='bench-mapping', adapter='mapping', field_mapping=NESTED_MAPPING))
+
+        self._run('serializer (WebhookSerializer)', events, serializer_path, FLAT_EVENT)
+        self._run('adapter: generic', events, generic.normalize, FLAT_EVENT)
+        self._run('adapter: mapping (nested)', events, mapping.normalize, NESTED_EVENT)
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from chatcore import compression
+from chatcore.models import WebhookEvent, WebhookHeaderSet
+
+
+class Command(BaseCommand):
+    help = 'Move legacy JSON webhook payloads/headers into compressed bodies and shared header sets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows rewritten per transaction')
+        parser.add_argument('--codec', type=str, default=None, help='Target codec (default: WEBHOOK_BODY_CODEC)')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        codec = options['codec'] or compression.default_codec()
+        header_sets = {}
+
+        pending = WebhookEvent.objects.filter(Q(raw_body__isnull=True) | ~Q(body_codec=codec)).order_by('pk')
+        last_pk = None
+        total = 0
+        while True:
+            qs = pending if last_pk is None else pending.filter(pk__gt=last_pk)
+            chunk = list(qs[:chunk_size])
+            if not chunk:
+                break
+            with transaction.atomic():
+                for event in chunk:
+                    # legacy rows only kept the parsed JSON, so re-serialize it
+                    body = event.body
+                    event.body_codec, event.raw_body = compression.compress(body, codec)
+                    if event.header_set_id is None:
+                        digest, stable, volatile = WebhookHeaderSet.split_headers(event.headers or {})
+                        if digest not in header_sets:
+                            header_sets[digest] = WebhookHeaderSet.id_for(digest, stable)
+                        event.header_set_id = header_sets[digest]
+                        event.volatile_headers = volatile or None
+                    event.raw_payload = None
+                    event.headers = None
+                WebhookEvent.objects.bulk_update(chunk, ['raw_body', 'body_codec', 'header_set', 'volatile_headers', 'raw_payload', 'headers'])
+            last_pk = chunk[-1].pk
+            total += len(chunk)
+            self.stdout.write(f'Compressed {total} webhook events...')
+
+        self.stdout.write(self.style.SUCCESS(f'Compressed {total} webhook events ({codec}, {len(header_sets)} header sets)'))
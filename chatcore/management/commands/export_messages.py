@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatcore.exports import EXPORT_FORMATS, export_queryset, parse_bound, render_export
+
+
+class Command(BaseCommand):
+    help = 'Stream messages to a file (or stdout) as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversation', type=str, help='Conversation id')
+        parser.add_argument('--source', type=str, help='Source slug')
+        parser.add_argument('--since', type=str, help='ISO date/datetime (inclusive)')
+        parser.add_argument('--until', type=str, help='ISO date/datetime (exclusive)')
+        parser.add_argument('--format', type=str, default='ndjson', choices=sorted(EXPORT_FORMATS))
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per cursor round trip')
+        parser.add_argument('--output', type=str, default='-', help='Output path ("-" for stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        qs = export_queryset(conversation=options['conversation'], source=options['source'], since=since, until=until)
+        chunks = render_export(qs, options['format'], gzip=options['gzip'], chunk_size=options['chunk_size'])
+
+        if options['output'] == '-':
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} bytes to {options["output"]}'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chatcore.analytics import rebuild_range
+from chatcore.exports import parse_bound
+
+
+class Command(BaseCommand):
+    help = 'Recompute the hourly analytics rollups for a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, required=True, help='ISO date/datetime (inclusive)')
+        parser.add_argument('--until', type=str, help='ISO date/datetime (exclusive, default: now)')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until']) or timezone.now()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if since >= until:
+            raise CommandError('--since must be before --until')
+
+        since, until = rebuild_range(since, until)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt analytics rollups from {since.isoformat()} to {until.isoformat()}'))
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatcore', '0003_message_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookHeaderSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('headers', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='body_codec',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='raw_body',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='headers',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='raw_payload',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='header_set',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='events', to='chatcore.webhookheaderset'),
+        ),
+    ]
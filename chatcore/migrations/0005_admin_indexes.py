@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatcore', '0004_webhook_compressed_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['created_at', 'id'], name='conversation_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['created_at', 'id'], name='message_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatcore', '0005_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='batch_max_size',
+            field=models.PositiveIntegerField(default=50),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='batch_outbound',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='batch_window_seconds',
+            field=models.PositiveIntegerField(default=2),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatcore', '0006_source_outbound_batching'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SourceHourlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('inbound_count', models.PositiveIntegerField(default=0)),
+                ('outbound_count', models.PositiveIntegerField(default=0)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('first_response_count', models.PositiveIntegerField(default=0)),
+                ('first_response_seconds', models.FloatField(default=0)),
+                ('backlog', models.PositiveIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_stats', to='chatcore.source')),
+            ],
+            options={
+                'unique_together': {('source', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatcore', '0007_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='assignment_policy',
+            field=models.CharField(choices=[('none', 'No automatic assignment'), ('least_loaded', 'Least-loaded agent'), ('round_robin', 'Round robin')], default='least_loaded', max_length=32),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:54
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatcore', '0008_source_assignment_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('request', 'Request'), ('task', 'Task')], max_length=16)),
+                ('name', models.CharField(max_length=500)),
+                ('method', models.CharField(blank=True, max_length=10)),
+                ('status', models.CharField(blank=True, max_length=32)),
+                ('username', models.CharField(blank=True, max_length=150)),
+                ('duration_ms', models.FloatField()),
+                ('query_count', models.PositiveIntegerField()),
+                ('query_time_ms', models.FloatField()),
+                ('duplicate_queries', models.JSONField(blank=True, default=list)),
+                ('profile', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatcore', '0009_request_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='adapter',
+            field=models.CharField(default='generic', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='field_mapping',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
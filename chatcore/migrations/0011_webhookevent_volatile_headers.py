@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatcore', '0010_source_payload_adapter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='volatile_headers',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,15 +1,61 @@
+import hashlib
+import json
+import threading
 import uuid
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+
+from . import compression
 
 
 class Source(models.Model):
+    ASSIGN_NONE = 'none'
+    ASSIGN_LEAST_LOADED = 'least_loaded'
+    ASSIGN_ROUND_ROBIN = 'round_robin'
+    ASSIGNMENT_CHOICES = [
+        (ASSIGN_NONE, 'No automatic assignment'),
+        (ASSIGN_LEAST_LOADED, 'Least-loaded agent'),
+        (ASSIGN_ROUND_ROBIN, 'Round robin'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     slug = models.SlugField(unique=True)
     display_name = models.CharField(max_length=200)
     inbound_secret = models.CharField(max_length=200, null=True, blank=True)
     outbound_endpoint_template = models.CharField(max_length=1000, null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    # opt-in: coalesce pending outbound messages into one request (a JSON array)
+    # sent after batch_window_seconds or once batch_max_size messages are queued
+    batch_outbound = models.BooleanField(default=False)
+    batch_max_size = models.PositiveIntegerField(default=50)
+    batch_window_seconds = models.PositiveIntegerField(default=2)
+    # how new inbound conversations are assigned to agents (see chatcore.assignment)
+    assignment_policy = models.CharField(max_length=32, choices=ASSIGNMENT_CHOICES, default=ASSIGN_LEAST_LOADED)
+    # payload adapter name and its declarative field paths (see chatcore.adapters)
+    adapter = models.CharField(max_length=50, default='generic')
+    field_mapping = models.JSONField(default=dict, blank=True)
+
+    def clean(self):
+        from .adapters import INBOUND_FIELDS, compile_outbound, registered_adapters
+        if self.adapter not in registered_adapters():
+            raise ValidationError({'adapter': f'Unknown adapter; choose one of {", ".join(registered_adapters())}.'})
+        mapping = self.field_mapping or {}
+        if not isinstance(mapping, dict) or set(mapping) - {'inbound', 'outbound'}:
+            raise ValidationError({'field_mapping': 'Expected an object with optional "inbound" and "outbound" keys.'})
+        for direction, paths in mapping.items():
+            if not isinstance(paths, dict) or not all(isinstance(k, str) and isinstance(v, str) and k and v for k, v in paths.items()):
+                raise ValidationError({'field_mapping': f'"{direction}" must map non-empty strings to non-empty strings.'})
+        unknown = sorted(set(mapping.get('inbound', {})) - set(INBOUND_FIELDS))
+        if unknown:
+            raise ValidationError({'field_mapping': f'Unknown inbound fields {", ".join(unknown)}; choose from {", ".join(INBOUND_FIELDS)}.'})
+        if mapping.get('outbound'):
+            try:
+                compile_outbound(json.dumps(mapping['outbound'], sort_keys=True))
+            except ValueError as exc:
+                raise ValidationError({'field_mapping': str(exc)})
 
     def __str__(self):
         return self.display_name
@@ -41,6 +87,11 @@ class Conversation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='conversation_created_idx'),
+        ]
+
     def __str__(self):
         return self.title or str(self.id)
 
@@ -80,6 +131,10 @@ class Message(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['source', 'external_message_id'], name='unique_external_message_id', condition=models.Q(external_message_id__isnull=False))
         ]
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='message_created_idx'),
+            models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+        ]
 
     def __str__(self):
         return f"{self.direction} {self.content[:40]}"
@@ -93,10 +148,164 @@ class DeliveryReceipt(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
 
 
+# digest -> committed WebhookHeaderSet id, per process
+_header_set_ids = {}
+_header_set_lock = threading.Lock()
+HEADER_SET_CACHE_SIZE = 1024
+
+
+class WebhookHeaderSet(models.Model):
+    """A distinct set of stable request headers, shared by every WebhookEvent that sent it.
+
+    Headers named in WEBHOOK_VOLATILE_HEADERS (client IPs, delivery ids, dates,
+    timestamped signatures) change on every request; they are kept on the event
+    itself so the remaining headers still deduplicate.
+    """
+    # rebuilt from the stored body, never stored
+    DERIVED_HEADERS = ('content-length',)
+
+    digest = models.CharField(max_length=64, unique=True)
+    headers = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def split_headers(cls, headers) -> tuple:
+        """Return ``(digest, stable, volatile)``; the digest covers the stable headers only."""
+        volatile_names = {name.lower() for name in getattr(settings, 'WEBHOOK_VOLATILE_HEADERS', ())}
+        stable, volatile = {}, {}
+        for name, value in dict(headers).items():
+            if name.lower() in cls.DERIVED_HEADERS:
+                continue
+            (volatile if name.lower() in volatile_names else stable)[name] = value
+        canonical = json.dumps(stable, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest(), stable, volatile
+
+    @classmethod
+    def id_for(cls, digest, headers):
+        """The id of the header set with ``digest``, created from ``headers`` if needed."""
+        pk = _header_set_ids.get(digest)
+        if pk is None:
+            pk = cls.objects.get_or_create(digest=digest, defaults={'headers': headers})[0].pk
+            # only remember rows that are committed; a rolled back id would dangle
+            transaction.on_commit(lambda: _remember_header_set(digest, pk))
+        return pk
+
+    def __str__(self):
+        return self.digest[:12]
+
+
+def _remember_header_set(digest, pk):
+    with _header_set_lock:
+        if len(_header_set_ids) >= HEADER_SET_CACHE_SIZE:
+            _header_set_ids.clear()
+        _header_set_ids[digest] = pk
+
+
+def clear_header_set_cache():
+    _header_set_ids.clear()
+
+
 class WebhookEvent(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     source = models.ForeignKey(Source, on_delete=models.CASCADE)
-    raw_payload = models.JSONField(default=dict)
-    headers = models.JSONField(default=dict)
+    # legacy JSON columns; new events store raw_body/header_set instead
+    raw_payload = models.JSONField(null=True, blank=True)
+    headers = models.JSONField(null=True, blank=True)
+    # exact received bytes, compressed with body_codec
+    raw_body = models.BinaryField(null=True, blank=True)
+    body_codec = models.CharField(max_length=8, blank=True, default='')
+    header_set = models.ForeignKey(WebhookHeaderSet, null=True, blank=True, on_delete=models.PROTECT, related_name='events')
+    # per-request headers (WEBHOOK_VOLATILE_HEADERS) left out of header_set
+    volatile_headers = models.JSONField(null=True, blank=True)
     processed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def record(cls, source, body: bytes, headers):
+        """Store an incoming request: compressed body, a shared header set and its volatile headers."""
+        codec, compressed = compression.compress(body)
+        digest, stable, volatile = WebhookHeaderSet.split_headers(headers)
+        return cls.objects.create(
+            source=source,
+            raw_body=compressed,
+            body_codec=codec,
+            header_set_id=WebhookHeaderSet.id_for(digest, stable),
+            volatile_headers=volatile or None,
+        )
+
+    @cached_property
+    def body(self) -> bytes:
+        """The received request body, decompressed on first access."""
+        if self.raw_body is None:
+            return json.dumps(self.raw_payload or {}).encode()
+        return compression.decompress(bytes(self.raw_body), self.body_codec)
+
+    @property
+    def payload(self):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            # non-JSON bodies (e.g. form posts) are only available as bytes
+            return None
+
+    @property
+    def request_headers(self) -> dict:
+        if self.header_set_id is None:
+            return self.headers or {}
+        headers = dict(self.header_set.headers)
+        headers.update(self.volatile_headers or {})
+        if self.raw_body is not None:
+            headers['Content-Length'] = str(len(self.body))
+        return headers
+
+
+class SourceHourlyStats(models.Model):
+    """Per-source, per-hour counters maintained incrementally by chatcore.analytics."""
+    source = models.ForeignKey(Source, on_delete=models.CASCADE, related_name='hourly_stats')
+    bucket = models.DateTimeField()  # start of the hour
+    inbound_count = models.PositiveIntegerField(default=0)
+    outbound_count = models.PositiveIntegerField(default=0)
+    # delivery receipts recorded in this hour
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    # replies that answered a waiting inbound message, and the summed wait
+    first_response_count = models.PositiveIntegerField(default=0)
+    first_response_seconds = models.FloatField(default=0)
+    # open conversations awaiting a reply, sampled while the hour was current
+    backlog = models.PositiveIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'bucket')
+
+
+class RollupWatermark(models.Model):
+    """How far a periodic rollup job has processed the source tables."""
+    name = models.CharField(max_length=100, unique=True)
+    position = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class RequestProfile(models.Model):
+    """A profiled request or Celery task (see chatcore.profiling)."""
+    KIND_REQUEST = 'request'
+    KIND_TASK = 'task'
+    KIND_CHOICES = [(KIND_REQUEST, 'Request'), (KIND_TASK, 'Task')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    name = models.CharField(max_length=500)  # request path or task name
+    method = models.CharField(max_length=10, blank=True)
+    status = models.CharField(max_length=32, blank=True)  # HTTP status or task state
+    username = models.CharField(max_length=150, blank=True)
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    query_time_ms = models.FloatField()
+    duplicate_queries = models.JSONField(default=list, blank=True)
+    profile = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.method} {self.name}".strip()
@@ -0,0 +1,186 @@
+"""Per-request and per-task profiling.
+
+A request is profiled when it is sampled (PROFILING_SAMPLE_RATE) or carries
+the ``X-Debug-Profile`` header; header-triggered profiles are only kept for
+staff users. The header value picks an optional profiler (``cprofile`` or
+``pyinstrument``); any other value records SQL only. The profiler only runs
+for staff logged in through the session: non-staff session users are not
+profiled at all, and token-authenticated requests (whose user is only known
+after the view ran) record SQL only. Celery tasks are sampled with
+PROFILING_TASK_SAMPLE_RATE.
+
+Each profile records the SQL query count and time, statements repeated at
+least PROFILING_DUPLICATE_THRESHOLD times (usually an N+1), and the profiler
+output. Profiles go to RequestProfile, trimmed to the newest
+PROFILING_BUFFER_SIZE rows, and are browsable in the admin.
+"""
+import cProfile
+import io
+import pstats
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db import connections
+
+from .models import RequestProfile
+
+HEADER = 'X-Debug-Profile'
+PROFILERS = ('cprofile', 'pyinstrument')
+
+try:
+    import pyinstrument
+except ImportError:  # optional dependency
+    pyinstrument = None
+
+
+class QueryRecorder:
+    """Database execute wrapper that records every statement and its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def total_ms(self):
+        return sum(duration for _, duration in self.queries) * 1000
+
+    def duplicates(self, threshold=None):
+        """Statements (with parameters left as placeholders) run ``threshold`` times or more."""
+        threshold = threshold or getattr(settings, 'PROFILING_DUPLICATE_THRESHOLD', 2)
+        counts = Counter(sql for sql, _ in self.queries)
+        return [{'sql': sql, 'count': n} for sql, n in counts.most_common() if n >= threshold]
+
+
+class ProfileSession:
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.recorder = QueryRecorder()
+        self._stack = ExitStack()
+        self._profile = None
+
+    def __enter__(self):
+        for conn in connections.all():
+            self._stack.enter_context(conn.execute_wrapper(self.recorder))
+        if self.profiler == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.profiler == 'pyinstrument' and pyinstrument is not None:
+            self._profile = pyinstrument.Profiler()
+            self._profile.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        if self.profiler == 'cprofile':
+            self._profile.disable()
+        elif self._profile is not None:
+            self._profile.stop()
+        self._stack.close()
+        return False
+
+    def profile_text(self):
+        if self._profile is None:
+            return ''
+        if self.profiler == 'cprofile':
+            out = io.StringIO()
+            pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(40)
+            return out.getvalue()
+        return self._profile.output_text()
+
+    def save(self, kind, name, **fields):
+        record = RequestProfile.objects.create(
+            kind=kind,
+            name=name[:500],
+            duration_ms=self.duration_ms,
+            query_count=len(self.recorder.queries),
+            query_time_ms=self.recorder.total_ms,
+            duplicate_queries=self.recorder.duplicates()[:20],
+            profile=self.profile_text(),
+            **fields,
+        )
+        _trim_buffer()
+        return record
+
+
+def _trim_buffer():
+    size = getattr(settings, 'PROFILING_BUFFER_SIZE', 500)
+    cutoff = list(RequestProfile.objects.order_by('-created_at').values_list('created_at', flat=True)[size:size + 1])
+    if cutoff:
+        RequestProfile.objects.filter(created_at__lte=cutoff[0]).delete()
+
+
+def _sampled(rate):
+    return rate > 0 and random.random() < rate
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = request.headers.get(HEADER)
+        sampled = _sampled(getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0))
+        if not requested and not sampled:
+            return self.get_response(request)
+
+        # session users are known here; token users only once DRF authenticates
+        # them inside the view
+        user = getattr(request, 'user', None)
+        session_staff = bool(user and user.is_authenticated and user.is_staff)
+        if requested and not sampled and user and user.is_authenticated and not session_staff:
+            return self.get_response(request)
+
+        if requested in PROFILERS and session_staff:
+            profiler = requested
+        elif sampled:
+            profiler = getattr(settings, 'PROFILING_PROFILER', '') or None
+        else:
+            # staff status not confirmed yet: record SQL only
+            profiler = None
+        with ProfileSession(profiler) as session:
+            response = self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        is_staff = bool(user and user.is_authenticated and user.is_staff)
+        if requested and not (sampled or is_staff):
+            return response
+        record = session.save(
+            kind=RequestProfile.KIND_REQUEST,
+            name=request.path,
+            method=request.method,
+            status=str(response.status_code),
+            username=user.get_username() if user and user.is_authenticated else '',
+        )
+        if is_staff:
+            response['X-Profile-Id'] = str(record.pk)
+        return response
+
+
+_task_sessions = {}
+
+
+@task_prerun.connect
+def _start_task_profile(task_id=None, task=None, **kwargs):
+    if _sampled(getattr(settings, 'PROFILING_TASK_SAMPLE_RATE', 0.0)):
+        session = ProfileSession(getattr(settings, 'PROFILING_PROFILER', '') or None)
+        _task_sessions[task_id] = session.__enter__()
+
+
+@task_postrun.connect
+def _save_task_profile(task_id=None, task=None, state=None, **kwargs):
+    session = _task_sessions.pop(task_id, None)
+    if session is None:
+        return
+    session.__exit__(None, None, None)
+    session.save(kind=RequestProfile.KIND_TASK, name=task.name, status=state or '')
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token
+
+
+def _invalidate(key):
+    invalidate_token(key)
+    # again once committed: a lookup during the transaction still read the old row
+    transaction.on_commit(lambda: invalidate_token(key))
+
+
+@receiver(post_delete, sender=Token)
+def drop_cached_token(sender, instance, **kwargs):
+    _invalidate(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def drop_cached_user_tokens(sender, instance, **kwargs):
+    # cached entries carry the user (is_active, is_staff, ...), so any change invalidates them
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        _invalidate(key)
@@ -1,7 +1,51 @@
 from celery import shared_task
 import requests
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 
-from .models import Message, DeliveryReceipt
+from . import analytics, assignment
+from .adapters import get_adapter
+from .models import Message, DeliveryReceipt, Source
+
+
+def build_outbound_payload(msg):
+    return get_adapter(msg.source).outbound_payload(msg)
+
+
+def _batch_key(source_id):
+    return f'chatcore:outbound-batch:{source_id}'
+
+
+def enqueue_outbound_message(msg):
+    """Queue delivery of an outbound message.
+
+    Sources with batch_outbound enabled share one batch task per window: the
+    first pending message schedules it, and reaching batch_max_size flushes
+    immediately.
+    """
+    source = msg.source
+    if not source.batch_outbound:
+        send_outbound_message.delay(str(msg.id))
+        return
+
+    key = _batch_key(source.pk)
+    timeout = source.batch_window_seconds + 60
+    if cache.add(key, 1, timeout=timeout):
+        pending = 1
+    else:
+        try:
+            pending = cache.incr(key)
+        except ValueError:
+            # the window closed between add() and incr()
+            cache.add(key, 1, timeout=timeout)
+            pending = 1
+
+    if pending == 1:
+        send_outbound_batch.apply_async((str(source.pk),), countdown=source.batch_window_seconds)
+    elif pending >= source.batch_max_size:
+        cache.delete(key)
+        send_outbound_batch.delay(str(source.pk))
 
 
 @shared_task(bind=True, max_retries=5, default_retry_delay=60)
@@ -11,27 +55,113 @@ def send_outbound_message(self, message_id):
     except Message.DoesNotExist:
         return
 
-    # build a simple payload
-    payload = {
-        'conversation_id': str(msg.conversation_id),
-        'external_user_id': msg.conversation.external_contact.external_id if msg.conversation.external_contact else None,
-        'content': msg.content,
-        'message_id': str(msg.id),
-    }
-
     endpoint = msg.source.outbound_endpoint_template
     headers = {'Content-Type': 'application/json'}
     try:
+        # a broken field mapping fails here and is recorded like a delivery error
+        payload = build_outbound_payload(msg)
         resp = requests.post(endpoint, json=payload, headers=headers, timeout=10)
         resp.raise_for_status()
         msg.status = Message.STATUS_SENT
         msg.save()
         DeliveryReceipt.objects.create(message=msg, status='SENT', provider_response={'status_code': resp.status_code})
     except Exception as exc:
+        # retry() re-raises exc itself once retries run out, so check the count here
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc)
+        msg.status = Message.STATUS_FAILED
+        msg.error_text = str(exc)
+        msg.save()
+        DeliveryReceipt.objects.create(message=msg, status='FAILED', provider_response={'error': str(exc)})
+
+
+def _batch_results(resp, msgs):
+    """Map a provider batch response to per-message result dicts keyed by message id.
+
+    Accepts either a JSON list or ``{"results": [...]}``; items are matched by
+    their ``message_id`` or, failing that, by position.
+    """
+    try:
+        body = resp.json()
+    except ValueError:
+        body = None
+    items = body.get('results') if isinstance(body, dict) else body
+    results = {}
+    if isinstance(items, list):
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            message_id = item.get('message_id') or (str(msgs[i].id) if i < len(msgs) else None)
+            if message_id:
+                results[str(message_id)] = item
+    return results
+
+
+def _item_error(item):
+    if item.get('error'):
+        return str(item['error'])
+    if item.get('ok') is False or str(item.get('status', '')).upper() == 'FAILED':
+        return 'rejected by provider'
+    return None
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
+def send_outbound_batch(self, source_id):
+    try:
+        source = Source.objects.get(pk=source_id)
+    except Source.DoesNotExist:
+        return
+    # messages queued from now on open a new window
+    cache.delete(_batch_key(source.pk))
+
+    with transaction.atomic():
+        # rows stay locked until results are written so concurrent batches skip them
+        msgs = list(
+            Message.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('conversation__external_contact')
+            .filter(source=source, direction=Message.DIRECTION_OUT, status=Message.STATUS_PENDING)
+            .order_by('created_at')[:source.batch_max_size]
+        )
+        if not msgs:
+            return
+
+        headers = {'Content-Type': 'application/json'}
         try:
-            self.retry(exc=exc)
-        except self.MaxRetriesExceededError:
-            msg.status = Message.STATUS_FAILED
-            msg.error_text = str(exc)
-            msg.save()
-            DeliveryReceipt.objects.create(message=msg, status='FAILED', provider_response={'error': str(exc)})
+            adapter = get_adapter(source)
+            payload = [adapter.outbound_payload(msg) for msg in msgs]
+            resp = requests.post(source.outbound_endpoint_template, json=payload, headers=headers, timeout=10)
+            resp.raise_for_status()
+        except Exception as exc:
+            if self.request.retries < self.max_retries:
+                raise self.retry(exc=exc)
+            results = {str(msg.id): {'error': str(exc)} for msg in msgs}
+            status_code = None
+        else:
+            results = _batch_results(resp, msgs)
+            status_code = resp.status_code
+
+        now = timezone.now()
+        receipts = []
+        for msg in msgs:
+            item = results.get(str(msg.id), {})
+            error = _item_error(item)
+            msg.status = Message.STATUS_FAILED if error else Message.STATUS_SENT
+            msg.error_text = error
+            msg.updated_at = now
+            receipts.append(DeliveryReceipt(
+                message=msg,
+                status=msg.status,
+                provider_response={'status_code': status_code, 'batch_size': len(msgs), 'result': item},
+            ))
+        Message.objects.bulk_update(msgs, ['status', 'error_text', 'updated_at'])
+        DeliveryReceipt.objects.bulk_create(receipts)
+
+
+@shared_task
+def update_analytics_rollups():
+    analytics.update_rollups()
+
+
+@shared_task
+def resync_agent_loads():
+    assignment.resync_loads()
@@ -1,6 +1,38 @@
-from django.test import TestCase, Client
-from django.urls import reverse
-from .models import Source, ExternalContact, Conversation, Message
+import csv
+import gzip
+import json
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import analytics, idempotency
+from .adapters import AdapterError, get_adapter, normalize_payload
+from .assignment import LOAD_KEY, adjust_load, assign_conversation, resync_loads
+from .authentication import FRONTEND_KEY, CachedTokenAuthentication, clear_local_cache, invalidate_token
+from .idempotency import BloomFilter
+from .models import (
+    Source, ExternalContact, Conversation, Message, DeliveryReceipt, WebhookEvent, WebhookHeaderSet, clear_header_set_cache,
+    RollupWatermark, SourceHourlyStats, RequestProfile,
+)
+from .paginators import LargeTablePaginator
+from .profiling import QueryRecorder
+from .serializers import WebhookSerializer
+from .tasks import build_outbound_payload, enqueue_outbound_message, send_outbound_batch, send_outbound_message
+from .views import AdminOrFrontendTokenPermission
 
 
 class WebhookTests(TestCase):
@@ -18,3 +50,722 @@ class WebhookTests(TestCase):
         resp = self.client.post(url, payload, content_type='application/json', HTTP_X_SIGNATURE='sha256=invalid')
         # signature invalid because we used secret; should be 401
         self.assertEqual(resp.status_code, 401)
+
+
+class WebhookEventStorageTests(TestCase):
+    def setUp(self):
+        self.src = Source.objects.create(slug='generic', display_name='Generic', inbound_secret='secret')
+        self.client = Client()
+
+    def tearDown(self):
+        clear_header_set_cache()
+
+    def test_incoming_stores_compressed_body_and_shared_headers(self):
+        url = reverse('incoming-webhook', kwargs={'source_slug': 'generic'})
+        for i in range(2):
+            body = '{"external_message_id": "ext-%d", "external_user_id": "user-1", "content": "Hi"}' % i
+            resp = self.client.post(
+                url, body, content_type='application/json', HTTP_X_SIGNATURE='secret',
+                HTTP_X_REAL_IP=f'10.0.0.{i}', HTTP_X_FORWARDED_FOR=f'10.0.0.{i}',
+            )
+            self.assertEqual(resp.status_code, 200)
+
+        events = sorted(WebhookEvent.objects.all(), key=lambda e: e.body)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(WebhookHeaderSet.objects.count(), 1)
+        self.assertNotIn('X-Real-Ip', WebhookHeaderSet.objects.get().headers)
+        self.assertEqual(events[0].body, b'{"external_message_id": "ext-0", "external_user_id": "user-1", "content": "Hi"}')
+        self.assertEqual(events[1].payload['external_message_id'], 'ext-1')
+        self.assertEqual(events[1].request_headers['Content-Length'], str(len(events[1].body)))
+        self.assertEqual(events[1].request_headers['X-Real-Ip'], '10.0.0.1')
+        self.assertEqual(events[1].request_headers['X-Signature'], 'secret')
+        self.assertIsNone(events[0].raw_payload)
+
+    @override_settings(WEBHOOK_VOLATILE_HEADERS=['X-Delivery'])
+    def test_known_header_set_skips_lookup(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = WebhookEvent.record(self.src, b'{}', {'User-Agent': 'provider', 'X-Delivery': '1'})
+        with self.assertNumQueries(1):
+            second = WebhookEvent.record(self.src, b'{}', {'User-Agent': 'provider', 'x-delivery': '2'})
+        self.assertEqual(first.header_set_id, second.header_set_id)
+        self.assertEqual(second.volatile_headers, {'x-delivery': '2'})
+
+    def test_compress_command_migrates_legacy_rows(self):
+        legacy = WebhookEvent.objects.create(source=self.src, raw_payload={'content': 'old'}, headers={'X-Signature': 'secret'})
+        call_command('compress_webhook_events', chunk_size=1, stdout=StringIO())
+
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.payload, {'content': 'old'})
+        self.assertEqual(legacy.request_headers['X-Signature'], 'secret')
+        self.assertIsNone(legacy.headers)
+
+
+class AdminScalingTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.src = Source.objects.create(slug='generic', display_name='Generic')
+        self.conv = Conversation.objects.create(source=self.src)
+        Message.objects.bulk_create([
+            Message(conversation=self.conv, source=self.src, direction=Message.DIRECTION_IN, content=f'msg {i}')
+            for i in range(60)
+        ])
+
+    def test_conversation_inline_is_limited_to_recent_messages(self):
+        resp = self.client.get(reverse('admin:chatcore_conversation_change', args=[self.conv.pk]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['inline_admin_formsets'][0].formset.total_form_count(), 50)
+
+    def test_large_table_paginator_pages_by_pk(self):
+        paginator = LargeTablePaginator(Message.objects.order_by('content', 'pk'), 25)
+        self.assertEqual(paginator.count, 60)
+        page = paginator.page(3)
+        self.assertEqual([m.content for m in page], sorted(f'msg {i}' for i in range(60))[50:])
+
+    def test_capped_count_is_shown_as_lower_bound(self):
+        with mock.patch.object(LargeTablePaginator, 'max_count', 50):
+            paginator = LargeTablePaginator(Message.objects.filter(source=self.src).order_by('pk'), 25)
+            self.assertEqual(paginator.count, 50)
+            self.assertEqual(str(paginator.count), '50+')
+            resp = self.client.get(reverse('admin:chatcore_message_changelist'), {'source__id__exact': self.src.pk})
+        self.assertContains(resp, '50+ messages')
+        self.assertEqual(str(LargeTablePaginator(Message.objects.order_by('pk'), 25).count), '60')
+
+    def test_postgres_estimate_is_shown_as_approximate(self):
+        qs = Message.objects.order_by('pk')
+        with mock.patch('chatcore.paginators.connections') as connections:
+            conn = connections[qs.db]
+            conn.vendor = 'postgresql'
+            conn.ops.quote_name.side_effect = lambda name: f'"{name}"'
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchone.return_value = (1234567,)
+            count = LargeTablePaginator(qs, 25).count
+        self.assertEqual((count, str(count)), (1234567, '~1234567'))
+        sql, params = cursor.execute.call_args.args
+        self.assertIn('oid = %s::regclass', sql)
+        self.assertEqual(params, ['"chatcore_message"'])
+
+    def test_message_changelist_does_not_query_per_row(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse('admin:chatcore_message_changelist'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.context['cl'].result_list), 60)
+        self.assertLess(len(ctx.captured_queries), 15)
+
+
+class OutboundBatchTests(TestCase):
+    def setUp(self):
+        self.src = Source.objects.create(
+            slug='batchy', display_name='Batchy', outbound_endpoint_template='http://example.local/out',
+            batch_outbound=True, batch_max_size=3,
+        )
+        contact = ExternalContact.objects.create(source=self.src, external_id='user-1')
+        self.conv = Conversation.objects.create(source=self.src, external_contact=contact)
+
+    def _outbound(self, text):
+        return Message.objects.create(conversation=self.conv, source=self.src, direction=Message.DIRECTION_OUT, content=text, status=Message.STATUS_PENDING)
+
+    def test_enqueue_coalesces_per_window_and_flushes_at_max_size(self):
+        with mock.patch('chatcore.tasks.send_outbound_batch') as task:
+            for i in range(3):
+                enqueue_outbound_message(self._outbound(f'reply {i}'))
+        task.apply_async.assert_called_once_with((str(self.src.pk),), countdown=self.src.batch_window_seconds)
+        task.delay.assert_called_once_with(str(self.src.pk))
+
+    def test_batch_sends_one_request_and_records_per_message_results(self):
+        msgs = [self._outbound(f'reply {i}') for i in range(2)]
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'results': [
+            {'message_id': str(msgs[0].id), 'status': 'ok'},
+            {'message_id': str(msgs[1].id), 'error': 'blocked'},
+        ]}
+        with mock.patch('chatcore.tasks.requests.post', return_value=response) as post:
+            send_outbound_batch.apply(args=(str(self.src.pk),))
+
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual([p['content'] for p in post.call_args.kwargs['json']], ['reply 0', 'reply 1'])
+        for msg in msgs:
+            msg.refresh_from_db()
+        self.assertEqual(msgs[0].status, Message.STATUS_SENT)
+        self.assertEqual(msgs[1].status, Message.STATUS_FAILED)
+        self.assertEqual(msgs[1].error_text, 'blocked')
+        self.assertEqual(DeliveryReceipt.objects.filter(message__in=msgs).count(), 2)
+
+
+class MessageExportTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.src = Source.objects.create(slug='generic', display_name='Generic')
+        self.conv = Conversation.objects.create(source=self.src)
+        other = Conversation.objects.create(source=self.src)
+        for i in range(3):
+            Message.objects.create(conversation=self.conv, source=self.src, direction=Message.DIRECTION_IN, content=f'line {i}')
+        Message.objects.create(conversation=other, source=self.src, direction=Message.DIRECTION_IN, content='elsewhere')
+
+    def test_conversation_export_streams_ndjson(self):
+        resp = self.client.get(reverse('conversation-export', kwargs={'conversation_id': self.conv.pk}))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        rows = [json.loads(line) for line in b''.join(resp.streaming_content).splitlines()]
+        self.assertEqual([r['content'] for r in rows], ['line 0', 'line 1', 'line 2'])
+        self.assertEqual(rows[0]['source'], 'generic')
+
+    def test_source_export_as_gzipped_csv(self):
+        resp = self.client.get(reverse('messages-export'), {'source': 'generic', 'output': 'csv', 'gzip': '1', 'since': '2000-01-01'})
+        self.assertEqual(resp['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(resp.streaming_content)).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'id')
+        self.assertEqual(len(lines), 5)
+
+    def test_invalid_bounds_are_rejected(self):
+        resp = self.client.get(reverse('messages-export'), {'since': 'yesterday'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_csv_neutralizes_formulas(self):
+        for content in ('=HYPERLINK("http://evil")', '+1', '-2', '@SUM(A1)'):
+            Message.objects.create(conversation=self.conv, source=self.src, direction=Message.DIRECTION_IN, content=content)
+        resp = self.client.get(reverse('conversation-export', kwargs={'conversation_id': self.conv.pk}), {'output': 'csv'})
+        rows = list(csv.DictReader(b''.join(resp.streaming_content).decode().splitlines()))
+        self.assertEqual(
+            sorted(r['content'] for r in rows),
+            sorted(["'=HYPERLINK(\"http://evil\")", "'+1", "'-2", "'@SUM(A1)", 'line 0', 'line 1', 'line 2']),
+        )
+        # NDJSON keeps the original text
+        resp = self.client.get(reverse('conversation-export', kwargs={'conversation_id': self.conv.pk}))
+        self.assertIn('+1', [json.loads(line)['content'] for line in b''.join(resp.streaming_content).splitlines()])
+
+    def test_unknown_conversation_is_404(self):
+        resp = self.client.get(reverse('conversation-export', kwargs={'conversation_id': uuid.uuid4()}))
+        self.assertEqual(resp.status_code, 404)
+
+
+class AnalyticsRollupTests(TestCase):
+    def setUp(self):
+        self.src = Source.objects.create(slug='generic', display_name='Generic')
+        self.conv = Conversation.objects.create(source=self.src)
+        self.start = datetime(2025, 1, 1, 10, 0, tzinfo=dt_timezone.utc)
+
+    def _message(self, direction, minutes):
+        msg = Message.objects.create(conversation=self.conv, source=self.src, direction=direction, content='x')
+        Message.objects.filter(pk=msg.pk).update(created_at=self.start + timedelta(minutes=minutes))
+        return msg
+
+    def test_rollups_count_volume_and_first_response(self):
+        self._message(Message.DIRECTION_IN, 0)
+        self._message(Message.DIRECTION_IN, 5)
+        reply = self._message(Message.DIRECTION_OUT, 10)
+        self._message(Message.DIRECTION_OUT, 12)  # follow-up, not a first response
+        receipt = DeliveryReceipt.objects.create(message=reply, status='SENT')
+        DeliveryReceipt.objects.filter(pk=receipt.pk).update(timestamp=self.start + timedelta(minutes=11))
+        self._message(Message.DIRECTION_IN, 70)
+
+        RollupWatermark.objects.create(name=analytics.WATERMARK_NAME, position=self.start)
+        analytics.update_rollups(now=self.start + timedelta(hours=2))
+
+        first = SourceHourlyStats.objects.get(source=self.src, bucket=self.start)
+        self.assertEqual((first.inbound_count, first.outbound_count, first.sent_count), (2, 2, 1))
+        self.assertEqual(first.first_response_count, 1)
+        self.assertEqual(first.first_response_seconds, 600)
+        second = SourceHourlyStats.objects.get(source=self.src, bucket=self.start + timedelta(hours=1))
+        self.assertEqual(second.inbound_count, 1)
+
+        # a second run only reads rows past the watermark
+        analytics.update_rollups(now=self.start + timedelta(hours=2, minutes=5))
+        first.refresh_from_db()
+        self.assertEqual(first.inbound_count, 2)
+
+        analytics.rebuild_range(self.start, self.start + timedelta(hours=1))
+        first.refresh_from_db()
+        self.assertEqual((first.inbound_count, first.outbound_count), (2, 2))
+
+    def test_hourly_api_reports_rates_and_backlog(self):
+        SourceHourlyStats.objects.create(source=self.src, bucket=self.start, sent_count=3, failed_count=1, first_response_count=2, first_response_seconds=90, backlog=4)
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(admin)
+        resp = self.client.get(reverse('analytics-hourly'), {'source': 'generic', 'since': '2025-01-01', 'until': '2025-01-02'})
+        self.assertEqual(resp.status_code, 200)
+        row = resp.json()[0]
+        self.assertEqual(row['failure_rate'], 0.25)
+        self.assertEqual(row['avg_first_response_seconds'], 45)
+        self.assertEqual(row['backlog'], 4)
+
+
+class AssignmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.alice = User.objects.create_user('alice', is_staff=True)
+        self.bob = User.objects.create_user('bob', is_staff=True)
+        User.objects.create_user('carol')  # not an agent
+        self.src = Source.objects.create(slug='generic', display_name='Generic')
+
+    def _post(self, thread, ext_id):
+        url = reverse('incoming-webhook', kwargs={'source_slug': 'generic'})
+        payload = {'external_message_id': ext_id, 'external_user_id': f'user-{thread}', 'thread_id': thread, 'content': 'hi'}
+        return self.client.post(url, payload, content_type='application/json')
+
+    def test_new_conversations_go_to_least_loaded_agent(self):
+        busy = Conversation.objects.create(source=self.src)
+        busy.participants.add(self.alice)
+
+        self._post('t1', 'e1')
+        self._post('t1', 'e2')  # same thread, no new assignment
+        self._post('t2', 'e3')
+
+        conv1 = Conversation.objects.get(metadata__thread_id='t1')
+        conv2 = Conversation.objects.get(metadata__thread_id='t2')
+        self.assertEqual(list(conv1.participants.all()), [self.bob])
+        self.assertEqual(conv2.participants.count(), 1)
+
+    def test_round_robin_rotates_per_source(self):
+        self.src.assignment_policy = Source.ASSIGN_ROUND_ROBIN
+        self.src.save()
+        picked = [assign_conversation(Conversation.objects.create(source=self.src)) for _ in range(4)]
+        self.assertEqual(picked, [self.alice.pk, self.bob.pk, self.alice.pk, self.bob.pk])
+
+    def test_conversation_list_defaults_to_my_inbox(self):
+        mine = Conversation.objects.create(source=self.src, title='mine')
+        mine.participants.add(self.alice)
+        other = Conversation.objects.create(source=self.src, title='other')
+        other.participants.add(self.bob)
+        self.client.force_login(self.alice)
+
+        resp = self.client.get(reverse('conversations-list'))
+        self.assertEqual([c['id'] for c in resp.json()], [str(mine.pk)])
+        resp = self.client.get(reverse('conversations-list'), {'mine': '0'})
+        self.assertEqual(len(resp.json()), 2)
+
+    def test_unassigned_conversation_stays_visible(self):
+        unassigned = Conversation.objects.create(source=self.src, title='unassigned')
+        self.client.force_login(self.alice)
+
+        resp = self.client.get(reverse('conversations-list'))
+        self.assertEqual([c['id'] for c in resp.json()], [str(unassigned.pk)])
+
+    def test_backfill_assigns_open_unassigned_conversations(self):
+        unassigned = Conversation.objects.create(source=self.src, title='unassigned')
+        closed = Conversation.objects.create(source=self.src, title='closed', is_closed=True)
+        out = StringIO()
+        call_command('assign_unassigned_conversations', stdout=out)
+        self.assertEqual(unassigned.participants.count(), 1)
+        self.assertEqual(closed.participants.count(), 0)
+        self.assertIn('Assigned 1 conversations', out.getvalue())
+
+
+class FakeRedis:
+    """The sorted-set/counter subset of redis-py used by chatcore.assignment."""
+
+    def __init__(self):
+        self.data = {}
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incr(self, key):
+        self.data[key] = self.data.get(key, 0) + 1
+        return self.data[key]
+
+    def zadd(self, key, mapping, nx=False, xx=False, incr=False):
+        zset = self.data.get(key, {})
+        for member, score in mapping.items():
+            member = str(member)
+            if (nx and member in zset) or (xx and member not in zset):
+                continue
+            zset[member] = zset.get(member, 0) + score if incr else score
+        if zset:
+            self.data[key] = zset
+
+    def zrem(self, key, member):
+        self.data.get(key, {}).pop(member, None)
+
+    def zscores(self, key):
+        return {int(m): score for m, score in self.data.get(key, {}).items()}
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+    def register_script(self, script):
+
+        def pick_least_loaded(keys):
+            # same as PICK_LEAST_LOADED: lowest score, ties by member
+            zset = self.data.get(keys[0], {})
+            if not zset:
+                return None
+            picked = min(zset, key=lambda m: (zset[m], m))
+            zset[picked] += 1
+            return picked.encode()
+        return pick_least_loaded
+
+
+class RedisAssignmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.alice = User.objects.create_user('alice', is_staff=True)
+        self.bob = User.objects.create_user('bob', is_staff=True)
+        self.src = Source.objects.create(slug='generic', display_name='Generic')
+        self.redis = FakeRedis()
+        patcher = mock.patch('chatcore.assignment.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _assign(self, policy):
+        self.src.assignment_policy = policy
+        self.src.save()
+        return assign_conversation(Conversation.objects.create(source=self.src))
+
+    def test_loads_are_seeded_from_the_database(self):
+        Conversation.objects.create(source=self.src).participants.add(self.alice)
+        self.assertEqual(self._assign(Source.ASSIGN_LEAST_LOADED), self.bob.pk)
+        self.assertEqual(self.redis.zscores(LOAD_KEY), {self.alice.pk: 1, self.bob.pk: 1})
+
+    def test_round_robin_seeds_loads_before_counting(self):
+        Conversation.objects.create(source=self.src).participants.add(self.bob)
+        Conversation.objects.create(source=self.src).participants.add(self.bob)
+        self.assertEqual(self._assign(Source.ASSIGN_ROUND_ROBIN), self.alice.pk)
+        self.assertEqual(self.redis.zscores(LOAD_KEY), {self.alice.pk: 1, self.bob.pk: 2})
+        self.assertEqual(self._assign(Source.ASSIGN_LEAST_LOADED), self.alice.pk)
+
+    def test_new_agents_join_and_stale_members_are_dropped(self):
+        self.redis.zadd(LOAD_KEY, {'999': -1, str(self.alice.pk): 3})
+        self.assertEqual(self._assign(Source.ASSIGN_LEAST_LOADED), self.bob.pk)
+        self.assertEqual(self.redis.zscores(LOAD_KEY), {self.alice.pk: 3, self.bob.pk: 1})
+
+    def test_adjust_load_does_not_create_the_set(self):
+        conv = Conversation.objects.create(source=self.src)
+        conv.participants.add(self.alice)
+        adjust_load(conv, -1)
+        self.assertFalse(self.redis.exists(LOAD_KEY))
+        resync_loads()
+        adjust_load(conv, -1)
+        self.assertEqual(self.redis.zscores(LOAD_KEY), {self.alice.pk: 0, self.bob.pk: 0})
+
+
+class WebhookIdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.src = Source.objects.create(slug='generic', display_name='Generic', assignment_policy=Source.ASSIGN_NONE)
+        self.url = reverse('incoming-webhook', kwargs={'source_slug': 'generic'})
+        self.payload = {'external_message_id': 'ext-1', 'external_user_id': 'user-1', 'content': 'Hello'}
+
+    def test_duplicate_is_rejected_before_db_work(self):
+        self.assertEqual(self.client.post(self.url, self.payload, content_type='application/json').json(), {'status': 'ok'})
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(self.url, self.payload, content_type='application/json')
+        self.assertEqual(resp.json(), {'status': 'duplicate'})
+        # only the source lookup
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_unique_constraint_is_final_authority(self):
+        self.client.post(self.url, self.payload, content_type='application/json')
+        cache.clear()  # e.g. the key was evicted
+        resp = self.client.post(self.url, self.payload, content_type='application/json')
+        self.assertEqual(resp.json(), {'status': 'duplicate'})
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(Conversation.objects.count(), 1)
+        # counted since the cache was cleared
+        [metrics] = idempotency.delivery_metrics(['generic'])
+        self.assertEqual((metrics['received'], metrics['duplicates']), (1, 1))
+
+    def test_invalid_payload_releases_claim_and_metrics_count_duplicates(self):
+        resp = self.client.post(self.url, {'external_message_id': 'ext-1'}, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.client.post(self.url, self.payload, content_type='application/json')
+        self.client.post(self.url, self.payload, content_type='application/json')
+
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(admin)
+        metrics = self.client.get(reverse('webhook-metrics')).json()
+        self.assertEqual(metrics, [{'source': 'generic', 'received': 3, 'duplicates': 1, 'duplicate_rate': 1 / 3}])
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(8192)
+        bloom.add('a')
+        self.assertIn('a', bloom)
+        self.assertNotIn('b', bloom)
+
+
+class FrontendKeyView(APIView):
+    permission_classes = [AdminOrFrontendTokenPermission]
+
+    def get(self, request):
+        return Response({'frontend': request.auth == FRONTEND_KEY})
+
+
+# used by tests that need a view outside the project's URLconf
+urlpatterns = [
+    path('frontend/', FrontendKeyView.as_view()),
+]
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        self.user = get_user_model().objects.create_user('agent', is_staff=True)
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_cached_lookup_needs_no_queries(self):
+        self.auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+        # the shared cache serves other processes
+        clear_local_cache()
+        with self.assertNumQueries(0):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_token_deletion_invalidates(self):
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    def test_user_deactivation_invalidates(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_cached_user_has_no_password_hash(self):
+        self.user.set_password('secret-pw')
+        self.user.save()
+        with CaptureQueriesContext(connection) as ctx:
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertNotIn('password', ctx.captured_queries[0]['sql'])
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertTrue(user.is_staff)
+
+    def test_invalidation_during_lookup_is_not_cached_over(self):
+        lookup = CachedTokenAuthentication.lookup
+
+        def racing_lookup(auth, key):
+            result = lookup(auth, key)
+            # the user changes after the row was read, before it is cached
+            invalidate_token(key)
+            return result
+
+        with mock.patch.object(CachedTokenAuthentication, 'lookup', racing_lookup):
+            self.auth.authenticate_credentials(self.token.key)
+        clear_local_cache()
+        with self.assertNumQueries(1):
+            self.auth.authenticate_credentials(self.token.key)
+
+    @override_settings(ROOT_URLCONF='chatcore.tests')
+    def test_frontend_key_skips_authentication(self):
+        with self.assertNumQueries(0):
+            resp = self.client.get('/frontend/', HTTP_X_API_KEY=settings.FRONTEND_API_KEY, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {'frontend': True})
+
+    @override_settings(ROOT_URLCONF='chatcore.tests')
+    def test_wrong_frontend_key_falls_back_to_token(self):
+        resp = self.client.get('/frontend/', HTTP_X_API_KEY='wrong', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(resp.json(), {'frontend': False})
+        resp = self.client.get('/frontend/', HTTP_X_API_KEY='wrong')
+        self.assertEqual(resp.status_code, 403)
+
+
+# Maximum queries per endpoint (authentication included). A view that goes over
+# its budget fails the suite; raise a budget only together with the change that
+# needs it.
+QUERY_BUDGETS = {
+    'conversations-list': 3,
+    'conversation-detail': 5,
+    'analytics-hourly': 3,
+}
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.admin)
+        src = Source.objects.create(slug='generic', display_name='Generic')
+        for i in range(5):
+            contact = ExternalContact.objects.create(source=src, external_id=f'user-{i}')
+            conv = Conversation.objects.create(source=src, external_contact=contact)
+            conv.participants.add(self.admin)
+            for j in range(3):
+                Message.objects.create(conversation=conv, source=src, direction=Message.DIRECTION_IN, content=f'm{j}')
+        self.conv = conv
+
+    def assertWithinBudget(self, name, url):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        budget = QUERY_BUDGETS[name]
+        self.assertLessEqual(
+            len(recorder.queries), budget,
+            f'{name} ran {len(recorder.queries)} queries (budget {budget}); repeated: {recorder.duplicates()}',
+        )
+
+    def test_conversations_list(self):
+        self.assertWithinBudget('conversations-list', reverse('conversations-list'))
+
+    def test_conversation_detail(self):
+        self.assertWithinBudget('conversation-detail', reverse('conversation-detail', kwargs={'pk': self.conv.pk}))
+
+    def test_analytics_hourly(self):
+        self.assertWithinBudget('analytics-hourly', reverse('analytics-hourly'))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user('staff', is_staff=True)
+        src = Source.objects.create(slug='generic', display_name='Generic')
+        for i in range(3):
+            Conversation.objects.create(source=src).participants.add(self.staff)
+
+    def test_staff_header_records_profile(self):
+        self.client.force_login(self.staff)
+        resp = self.client.get(reverse('conversations-list'), HTTP_X_DEBUG_PROFILE='cprofile')
+        profile = RequestProfile.objects.get(pk=resp['X-Profile-Id'])
+        self.assertEqual(profile.name, reverse('conversations-list'))
+        self.assertEqual(profile.status, '200')
+        self.assertGreater(profile.query_count, 0)
+        self.assertIn('cumulative', profile.profile)
+
+    def test_header_is_ignored_for_anonymous_users(self):
+        with mock.patch('chatcore.profiling.cProfile.Profile') as profile:
+            for value in ('1', 'cprofile', 'pyinstrument'):
+                resp = self.client.get(reverse('conversations-list'), HTTP_X_DEBUG_PROFILE=value)
+                self.assertNotIn('X-Profile-Id', resp)
+        profile.assert_not_called()
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_header_is_ignored_for_non_staff_session_users(self):
+        self.client.force_login(get_user_model().objects.create_user('agent'))
+        with mock.patch('chatcore.profiling.ProfileSession') as session:
+            resp = self.client.get(reverse('conversations-list'), HTTP_X_DEBUG_PROFILE='cprofile')
+        session.assert_not_called()
+        self.assertNotIn('X-Profile-Id', resp)
+
+    def test_token_staff_records_sql_only(self):
+        token = Token.objects.create(user=self.staff)
+        with mock.patch('chatcore.profiling.cProfile.Profile') as profile:
+            resp = self.client.get(
+                reverse('conversations-list'), HTTP_X_DEBUG_PROFILE='cprofile', HTTP_AUTHORIZATION=f'Token {token.key}',
+            )
+        profile.assert_not_called()
+        record = RequestProfile.objects.get(pk=resp['X-Profile-Id'])
+        self.assertGreater(record.query_count, 0)
+        self.assertEqual(record.profile, '')
+
+    def test_repeated_queries_are_reported(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for conv in Conversation.objects.all():
+                list(conv.messages.all())
+        self.assertEqual(recorder.duplicates()[0]['count'], 3)
+
+
+class PayloadAdapterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.src = Source.objects.create(
+            slug='nested', display_name='Nested', adapter='mapping', assignment_policy=Source.ASSIGN_NONE,
+            field_mapping={
+                'inbound': {
+                    'external_message_id': 'id',
+                    'external_user_id': 'sender.id',
+                    'content': 'message.text',
+                    'thread_id': 'conversation.id',
+                    'attachments': 'message.files',
+                },
+                'outbound': {'recipient.id': 'external_user_id', 'message.text': 'content'},
+            },
+        )
+
+    def test_mapping_adapter_normalizes_nested_payload(self):
+        url = reverse('incoming-webhook', kwargs={'source_slug': 'nested'})
+        payload = {'id': 'm-1', 'sender': {'id': 'u-1'}, 'message': {'text': 'Hi', 'files': [{'url': 'a.png'}]}, 'conversation': {'id': 't-1'}}
+        resp = self.client.post(url, payload, content_type='application/json')
+        self.assertEqual(resp.json(), {'status': 'ok'})
+
+        msg = Message.objects.get()
+        self.assertEqual((msg.external_message_id, msg.content), ('m-1', 'Hi'))
+        self.assertEqual(msg.attachments, [{'url': 'a.png'}])
+        self.assertEqual(msg.conversation.external_contact.external_id, 'u-1')
+        self.assertEqual(msg.conversation.metadata['thread_id'], 't-1')
+
+        resp = self.client.post(url, {'id': 'm-2', 'message': {'text': 'no sender'}}, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json(), {'external_user_id': ['This field is required.']})
+
+    def test_mapping_adapter_shapes_outbound_payload(self):
+        contact = ExternalContact.objects.create(source=self.src, external_id='u-1')
+        conv = Conversation.objects.create(source=self.src, external_contact=contact)
+        msg = Message.objects.create(conversation=conv, source=self.src, direction=Message.DIRECTION_OUT, content='Reply')
+        self.assertEqual(build_outbound_payload(msg), {'recipient': {'id': 'u-1'}, 'message': {'text': 'Reply'}})
+
+    def test_generic_adapter_matches_serializer(self):
+        adapter = get_adapter(Source(slug='flat'))
+        for payload in (
+            {'external_message_id': 'e-1', 'external_user_id': 'u-1', 'content': 'Hi'},
+            {'external_user_id': 7, 'thread_id': ''},
+            {'content': 'missing user'},
+            {'external_user_id': ''},
+            {'external_user_id': ['not', 'a', 'string']},
+            {'external_user_id': 'u\x00x'},
+            {'external_user_id': 'u-1', 'content': 'bad \ud800 char'},
+            {'external_user_id': 'u-1', 'content': '\x00\ud800'},
+            {'external_user_id': 'u-1', 'content': None},
+            {'external_user_id': 'u-1', 'timestamp': None, 'thread_id': None, 'external_message_id': None},
+            {'external_user_id': None},
+            {'external_user_id': '  u-1  ', 'content': '   '},
+            {'external_user_id': 'u', 'raw': None},
+            {'raw': None},
+            {'external_user_id': 'u', 'raw': 'text'},
+            {'external_user_id': 'u', 'raw': {'k': 'v'}},
+        ):
+            serializer = WebhookSerializer(data=payload)
+            if serializer.is_valid():
+                self.assertEqual(adapter.normalize(payload), normalize_payload(serializer.validated_data))
+            else:
+                with self.assertRaises(AdapterError) as ctx:
+                    adapter.normalize(payload)
+                self.assertEqual(ctx.exception.errors, serializer.errors)
+
+    def test_mapping_adapter_rejects_explicit_null(self):
+        adapter = get_adapter(self.src)
+        with self.assertRaises(AdapterError) as ctx:
+            adapter.normalize({'sender': {'id': 'u-1'}, 'message': {'text': None}})
+        self.assertEqual(ctx.exception.errors, {'content': ['This field may not be null.']})
+
+    def test_conflicting_outbound_paths_are_rejected_on_clean(self):
+        self.src.field_mapping = {'outbound': {'message': 'content', 'message.text': 'content'}}
+        with self.assertRaisesMessage(ValidationError, 'outbound paths "message" and "message.text" conflict'):
+            self.src.full_clean()
+
+    def test_unknown_inbound_field_is_rejected_on_clean(self):
+        self.src.field_mapping = {'inbound': {'contnet': 'message.text'}}
+        with self.assertRaisesMessage(ValidationError, 'Unknown inbound fields contnet'):
+            self.src.full_clean()
+
+    def test_broken_outbound_mapping_fails_delivery(self):
+        Source.objects.filter(pk=self.src.pk).update(field_mapping={'outbound': {'message': 'content', 'message.text': 'content'}})
+        conv = Conversation.objects.create(source=self.src)
+        msg = Message.objects.create(conversation=conv, source=self.src, direction=Message.DIRECTION_OUT, content='Reply', status=Message.STATUS_PENDING)
+        with mock.patch('chatcore.tasks.requests.post') as post:
+            send_outbound_message.apply(args=(str(msg.id),), retries=send_outbound_message.max_retries)
+        post.assert_not_called()
+        msg.refresh_from_db()
+        self.assertEqual(msg.status, Message.STATUS_FAILED)
+        self.assertIn('conflict', msg.error_text)
+        self.assertEqual(DeliveryReceipt.objects.get(message=msg).status, 'FAILED')
+
+    def test_unknown_adapter_is_rejected_on_clean(self):
+        with self.assertRaises(ValidationError):
+            Source(slug='x', display_name='X', adapter='nope').full_clean()
@@ -1,11 +1,15 @@
 from django.urls import path
 from rest_framework.authtoken.views import obtain_auth_token
-from .views import ConversationListView, ReplyCreateView, ConversationDetailView, MessageSeenView
+from .views import ConversationListView, ReplyCreateView, ConversationDetailView, MessageSeenView, MessageExportView, AnalyticsHourlyView, WebhookMetricsView
 
 urlpatterns = [
     path('conversations/', ConversationListView.as_view(), name='conversations-list'),
     path('conversations/<uuid:conversation_id>/reply/', ReplyCreateView.as_view(), name='conversation-reply'),
     path('conversations/<uuid:pk>/', ConversationDetailView.as_view(), name='conversation-detail'),
+    path('conversations/<uuid:conversation_id>/export/', MessageExportView.as_view(), name='conversation-export'),
+    path('exports/messages/', MessageExportView.as_view(), name='messages-export'),
+    path('analytics/hourly/', AnalyticsHourlyView.as_view(), name='analytics-hourly'),
+    path('metrics/webhooks/', WebhookMetricsView.as_view(), name='webhook-metrics'),
     # simple token obtain endpoint: POST {username, password} -> {token}
     path('auth/token/', obtain_auth_token, name='api-token-auth'),
     path('messages/<uuid:message_id>/seen/', MessageSeenView.as_view(), name='message-seen'),
@@ -1,15 +1,25 @@
+import uuid
+from datetime import timedelta
+
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .models import Source, WebhookEvent, ExternalContact, Conversation, Message
-from .serializers import WebhookSerializer, ConversationSerializer
-from django.db.models import Max, DateTimeField, Count, Q
+from .models import Source, WebhookEvent, ExternalContact, Conversation, Message, SourceHourlyStats
+from .serializers import ConversationSerializer
+from . import idempotency
+from .adapters import AdapterError, get_adapter
+from .assignment import assign_conversation
+from .authentication import FRONTEND_KEY
+from .exports import EXPORT_FORMATS, export_queryset, parse_bound, render_export
+from django.db.models import Max, DateTimeField, Count, Exists, Q, OuterRef, Subquery
 from django.db.models.functions import Coalesce
 from rest_framework import generics
 from rest_framework.permissions import IsAdminUser, BasePermission
-from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework.decorators import action
 from rest_framework.response import Response as DRFResponse
 from rest_framework import status as drf_status
@@ -25,22 +35,23 @@ class ConversationListView(generics.ListAPIView):
         # annotate with latest message time; if no messages exist, use conversation.updated_at
         qs = qs.annotate(
             last_msg_time=Coalesce(Max('messages__created_at'), 'updated_at', output_field=DateTimeField()),
-            unseen_count=Count('messages', filter=Q(messages__direction='IN') & (~Q(messages__seen=True)))
+            unseen_count=Count('messages', filter=Q(messages__direction='IN') & (~Q(messages__seen=True))),
+            last_message=Subquery(Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at').values('content')[:1]),
         )
         qs = qs.order_by('-last_msg_time')
-        # if ?mine=1 is provided, filter to conversations where the requesting
-        # user is a participant. This enables a per-user chatroom view.
-        if request.query_params.get('mine') in ('1', 'true', 'True') and request.user.is_authenticated:
-            qs = qs.filter(participants=request.user)
+        # by default authenticated users see their assigned inbox plus conversations
+        # nobody is assigned to yet; ?mine=0 lists every conversation.
+        if request.query_params.get('mine', '1') in ('1', 'true', 'True') and request.user.is_authenticated:
+            participants = Conversation.participants.through.objects.filter(conversation=OuterRef('pk'))
+            qs = qs.filter(Exists(participants.filter(user=request.user)) | ~Exists(participants))
         qs = qs[:100]
         data = []
         for c in qs:
-            last = c.messages.order_by('-created_at').first()
             data.append({
                 'id': str(c.id),
                 'source': c.source.slug,
                 'external_contact': c.external_contact.external_id if c.external_contact else None,
-                'last_message': last.content if last else None,
+                'last_message': c.last_message,
                 'updated_at': c.updated_at,
                 'has_unseen': bool(getattr(c, 'unseen_count', 0)),
             })
@@ -54,13 +65,11 @@ class AdminOrFrontendTokenPermission(BasePermission):
     authentication mechanism for production.
     """
     def has_permission(self, request, view):
-        # admin session user
-        if request.user and request.user.is_authenticated and request.user.is_staff:
+        # X-API-KEY is checked by FrontendKeyAuthentication before any token/session lookup
+        if request.auth == FRONTEND_KEY:
             return True
-        # header token
-        token = request.headers.get('X-API-KEY') or request.META.get('HTTP_X_API_KEY')
-        expected = getattr(settings, 'FRONTEND_API_KEY', None)
-        return bool(token and expected and token == expected)
+        # admin session/token user
+        return bool(request.user and request.user.is_authenticated and request.user.is_staff)
 
 
 class ReplyCreateView(APIView):
@@ -82,8 +91,8 @@ class ReplyCreateView(APIView):
         )
         # enqueue send task
         try:
-            from .tasks import send_outbound_message
-            send_outbound_message.delay(str(msg.id))
+            from .tasks import enqueue_outbound_message
+            enqueue_outbound_message(msg)
         except Exception:
             pass
         return DRFResponse({'id': str(msg.id), 'status': msg.status})
@@ -100,18 +109,6 @@ def verify_signature(secret: str, body: bytes, header_signature: str) -> bool:
     return header_signature.strip() == secret.strip()
 
 
-def normalize_payload(data: dict) -> dict:
-    # Minimal normalization: assume input has fields we defined in serializer
-    return {
-        'external_message_id': data.get('external_message_id'),
-        'external_user_id': data.get('external_user_id'),
-        'timestamp': data.get('timestamp'),
-        'content': data.get('content'),
-        'thread_id': data.get('thread_id'),
-        'raw': data,
-    }
-
-
 class IncomingWebhookView(APIView):
     def post(self, request, source_slug):
         source = get_object_or_404(Source, slug=source_slug, is_active=True)
@@ -121,41 +118,77 @@ class IncomingWebhookView(APIView):
             if not verify_signature(source.inbound_secret, raw_body, sig_header):
                 return Response({'detail': 'invalid signature'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        serializer = WebhookSerializer(data=request.data)
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-        WebhookEvent.objects.create(source=source, raw_payload=request.data, headers=dict(request.headers))
-
-        normalized = normalize_payload(serializer.validated_data)
-
-        ext_id = normalized.get('external_message_id')
-        # idempotency check
-        if ext_id and Message.objects.filter(source=source, external_message_id=ext_id).exists():
-            return Response({'status': 'duplicate'}, status=status.HTTP_200_OK)
+        adapter = get_adapter(source)
+        # idempotency fast path: reject provider retries before any DB work
+        data = request.data
+        ext_id = str(adapter.message_id(data) or '')
+        if ext_id:
+            claim = idempotency.claim(source.pk, ext_id)
+            if claim != idempotency.NEW:
+                idempotency.record_delivery(source.slug, duplicate=True)
+                if claim == idempotency.IN_PROGRESS:
+                    return Response({'status': 'in_progress'}, status=status.HTTP_409_CONFLICT)
+                return Response({'status': 'duplicate'}, status=status.HTTP_200_OK)
+
+        # counted once the outcome is known: the unique constraint can still
+        # reveal a duplicate the cache missed
+        duplicate = False
+        try:
+            try:
+                normalized = adapter.normalize(data)
+            except AdapterError as exc:
+                if ext_id:
+                    idempotency.release(source.pk, ext_id)
+                return Response(exc.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            WebhookEvent.record(source, raw_body, request.headers)
+            try:
+                with transaction.atomic():
+                    conv, created = self._store_message(source, normalized)
+            except IntegrityError:
+                # stored concurrently by a request the cache did not catch;
+                # unique_external_message_id is the final authority
+                duplicate = True
+                if ext_id:
+                    idempotency.complete(source.pk, ext_id)
+                return Response({'status': 'duplicate'}, status=status.HTTP_200_OK)
+        except Exception:
+            if ext_id:
+                idempotency.release(source.pk, ext_id)
+            raise
+        finally:
+            idempotency.record_delivery(source.slug, duplicate=duplicate)
+
+        if ext_id:
+            idempotency.complete(source.pk, ext_id)
+        if created:
+            assign_conversation(conv)
+        return Response({'status': 'ok'}, status=status.HTTP_200_OK)
 
+    def _store_message(self, source, normalized):
         contact, _ = ExternalContact.objects.get_or_create(source=source, external_id=normalized['external_user_id'], defaults={'display_name': None})
 
         # find or create conversation by thread_id
         conv = None
+        created = False
         thread_id = normalized.get('thread_id')
         if thread_id:
             conv = Conversation.objects.filter(source=source, metadata__thread_id=thread_id).first()
         if not conv:
             conv = Conversation.objects.create(source=source, metadata=normalized , external_contact=contact)
+            created = True
 
         Message.objects.create(
             conversation=conv,
             direction=Message.DIRECTION_IN,
             sender_name=contact.display_name,
             content=normalized.get('content'),
-            external_message_id=ext_id,
+            external_message_id=normalized.get('external_message_id') or None,
             source=source,
             status=Message.STATUS_RECEIVED,
             attachments=normalized.get('raw', {}).get('attachments', []),
         )
-
-        return Response({'status': 'ok'}, status=status.HTTP_200_OK)
+        return conv, created
 
 
 class MockProviderReceiveView(APIView):
@@ -166,6 +199,8 @@ class MockProviderReceiveView(APIView):
     """
 
     def post(self, request):
+        # read the raw bytes before request.data consumes the stream
+        raw_body = request.body
         # Log to stdout so it appears in container logs
         print('--- Mock provider received payload ---')
         print(request.data)
@@ -173,7 +208,7 @@ class MockProviderReceiveView(APIView):
         # Optionally persist as a WebhookEvent for auditing
         try:
             src = Source.objects.first()
-            WebhookEvent.objects.create(source=src, raw_payload=request.data, headers=dict(request.headers))
+            WebhookEvent.record(src, raw_body, request.headers)
         except Exception:
             pass
         return Response({'received': True}, status=status.HTTP_200_OK)
@@ -196,3 +231,87 @@ class ConversationDetailView(generics.RetrieveAPIView):
     queryset = Conversation.objects.all().select_related('external_contact', 'source')
     serializer_class = ConversationSerializer
 
+
+class MessageExportView(APIView):
+    """Stream messages as NDJSON or CSV.
+
+    Filters: ``conversation`` (or the conversation in the URL), ``source`` (slug),
+    ``since``/``until`` (ISO date or datetime, until is exclusive). ``output`` is
+    ``ndjson`` (default) or ``csv``; ``gzip=1`` compresses on the fly.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, conversation_id=None):
+        params = request.query_params
+        output = params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return DRFResponse({'detail': f'output must be one of {", ".join(EXPORT_FORMATS)}'}, status=drf_status.HTTP_400_BAD_REQUEST)
+        if conversation_id is not None:
+            get_object_or_404(Conversation.objects.only('pk'), pk=conversation_id)
+        conversation = conversation_id or params.get('conversation')
+        try:
+            if conversation:
+                conversation = uuid.UUID(str(conversation))
+            since = parse_bound(params.get('since'))
+            until = parse_bound(params.get('until'))
+        except ValueError as exc:
+            return DRFResponse({'detail': str(exc)}, status=drf_status.HTTP_400_BAD_REQUEST)
+
+        gzip = params.get('gzip') in ('1', 'true', 'True')
+        qs = export_queryset(conversation=conversation, source=params.get('source'), since=since, until=until)
+        content_type, extension = EXPORT_FORMATS[output]
+        filename = f'messages.{extension}'
+        if gzip:
+            content_type = 'application/gzip'
+            filename += '.gz'
+        response = StreamingHttpResponse(render_export(qs, output, gzip=gzip), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class AnalyticsHourlyView(APIView):
+    """Hourly per-source time series from the analytics rollups.
+
+    Query params: ``source`` (slug, optional), ``since``/``until`` (ISO date or
+    datetime; default the last 24 hours).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            since = parse_bound(params.get('since'))
+            until = parse_bound(params.get('until'))
+        except ValueError as exc:
+            return DRFResponse({'detail': str(exc)}, status=drf_status.HTTP_400_BAD_REQUEST)
+        until = until or timezone.now()
+        since = since or until - timedelta(hours=24)
+
+        qs = SourceHourlyStats.objects.filter(bucket__gte=since, bucket__lt=until).select_related('source').order_by('bucket', 'source__slug')
+        if params.get('source'):
+            qs = qs.filter(source__slug=params['source'])
+        data = []
+        for row in qs:
+            delivered = row.sent_count + row.failed_count
+            data.append({
+                'source': row.source.slug,
+                'bucket': row.bucket,
+                'inbound': row.inbound_count,
+                'outbound': row.outbound_count,
+                'sent': row.sent_count,
+                'failed': row.failed_count,
+                'failure_rate': (row.failed_count / delivered) if delivered else None,
+                'first_responses': row.first_response_count,
+                'avg_first_response_seconds': (row.first_response_seconds / row.first_response_count) if row.first_response_count else None,
+                'backlog': row.backlog,
+            })
+        return DRFResponse(data)
+
+
+class WebhookMetricsView(APIView):
+    """Per-source webhook delivery counters, including the duplicate rate."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        slugs = Source.objects.order_by('slug').values_list('slug', flat=True)
+        return DRFResponse(idempotency.delivery_metrics(list(slugs)))
@@ -47,6 +47,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chatcore.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,6 +98,39 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 
+CELERY_BEAT_SCHEDULE = {
+    'update-analytics-rollups': {
+        'task': 'chatcore.tasks.update_analytics_rollups',
+        'schedule': 60.0,
+    },
+    'resync-agent-loads': {
+        'task': 'chatcore.tasks.resync_agent_loads',
+        'schedule': 300.0,
+    },
+}
+
+# Webhook idempotency: how long a stored (source, external_message_id) is
+# remembered in the cache, and the size of the optional in-process bloom filter
+# in front of it (0 disables it).
+WEBHOOK_IDEMPOTENCY_TTL = int(os.environ.get('WEBHOOK_IDEMPOTENCY_TTL', '86400'))
+WEBHOOK_IDEMPOTENCY_BLOOM_BITS = int(os.environ.get('WEBHOOK_IDEMPOTENCY_BLOOM_BITS', '0'))
+
+# Only members of this group receive automatically assigned conversations
+# (default: every active staff user).
+CHAT_AGENT_GROUP = os.environ.get('CHAT_AGENT_GROUP') or None
+
+# Rows younger than this are left for the next rollup run (see chatcore.analytics).
+ANALYTICS_ROLLUP_LAG_SECONDS = int(os.environ.get('ANALYTICS_ROLLUP_LAG_SECONDS', '60'))
+
+# Shared cache used for cross-process coordination (e.g. outbound batching).
+# Point it at Redis in any multi-process deployment; without DJANGO_CACHE_URL a
+# per-process in-memory cache is used, which is only suitable for local dev/tests.
+CACHE_URL = os.environ.get('DJANGO_CACHE_URL')
+if CACHE_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 # allow local frontend dev
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
@@ -108,16 +142,42 @@ CORS_ALLOW_CREDENTIALS = True
 # In production you should replace this with a proper auth flow (session, JWT, OAuth).
 FRONTEND_API_KEY = os.environ.get('FRONTEND_API_KEY', 'dev-frontend-token')
 
+# Codec for stored webhook bodies: 'zlib' (always available) or 'zstd' (needs the
+# optional zstandard package; falls back to zlib when it is missing).
+WEBHOOK_BODY_CODEC = os.environ.get('WEBHOOK_BODY_CODEC', 'zlib')
+
+# Webhook headers that change on every request (comma-separated, case-insensitive).
+# They are stored on each WebhookEvent; the rest are deduplicated into shared
+# WebhookHeaderSet rows.
+WEBHOOK_VOLATILE_HEADERS = [h.strip() for h in os.environ.get(
+    'WEBHOOK_VOLATILE_HEADERS',
+    'Date,X-Real-Ip,X-Forwarded-For,X-Request-Id,X-Delivery-Id,X-Hub-Signature,X-Hub-Signature-256,Stripe-Signature',
+).split(',') if h.strip()]
+
 # REST framework settings: enable TokenAuthentication (and keep SessionAuth for admin UI).
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'chatcore.authentication.FrontendKeyAuthentication',
+        'chatcore.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     # default permission can remain permissive; views opt-in to stricter checks.
 }
 
+# Cached token lookups (see chatcore.authentication): seconds a token stays in
+# the per-process cache and in the shared cache.
+TOKEN_AUTH_LOCAL_TTL = int(os.environ.get('TOKEN_AUTH_LOCAL_TTL', '5'))
+TOKEN_AUTH_CACHE_TTL = int(os.environ.get('TOKEN_AUTH_CACHE_TTL', '300'))
+
+# Request/task profiling (see chatcore.profiling). Staff can also profile a
+# single request with the X-Debug-Profile header.
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_TASK_SAMPLE_RATE = float(os.environ.get('PROFILING_TASK_SAMPLE_RATE', '0'))
+PROFILING_PROFILER = os.environ.get('PROFILING_PROFILER', '')  # '', 'cprofile' or 'pyinstrument'
+PROFILING_BUFFER_SIZE = int(os.environ.get('PROFILING_BUFFER_SIZE', '500'))
+PROFILING_DUPLICATE_THRESHOLD = int(os.environ.get('PROFILING_DUPLICATE_THRESHOLD', '2'))
+
 # drf-spectacular settings (minimal)
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Chatroom API',